@@ -0,0 +1,385 @@
+"""
+Async (ASGI) entry point for Kugou widget
+Serves the widget routes without blocking a worker on each in-flight upstream call.
+The Flask app in index.py stays the default entry point; run this one with e.g.
+    cd api && hypercorn asgi:app --bind 0.0.0.0:8000
+"""
+from quart import Quart, Response, request, jsonify, g
+import asyncio
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+
+# Add the current directory to path for local imports
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+import index
+from deadline import DEADLINE_RESERVE_SECONDS, NO_DEADLINE, Deadline
+from metrics import (
+    PROMETHEUS_CONTENT_TYPE, REQUEST_SECONDS, RESPONSES, render_prometheus, server_timing_headers,
+    start_trace, timed, trace_step
+)
+from singleflight import AsyncSingleFlight
+from song_events import (
+    SSE_HEADERS, SSE_HEARTBEAT_FRAME, SSE_HEARTBEAT_SECONDS, SSE_MAX_SECONDS, SSE_RETRY_FRAME, sse_frame
+)
+from svg_output import as_encoded, encoded_etag, etag_matches, matched_etag, not_modified_headers
+
+app = Quart(__name__)
+
+# Upstream connection limits for the shared async client
+ASYNC_MAX_CONNECTIONS = int(os.getenv("ASYNC_MAX_CONNECTIONS", 200))
+ASYNC_MAX_KEEPALIVE = int(os.getenv("ASYNC_MAX_KEEPALIVE", 50))
+
+# Threads for blocking storage calls made via asyncio.to_thread
+ASYNC_STORAGE_THREADS = int(os.getenv("ASYNC_STORAGE_THREADS", 64))
+
+# One KuGouMusicApi fetch per user at a time within the event loop
+async_upstream_flight = AsyncSingleFlight(name="async_upstream")
+
+http_client = None
+
+
+@app.before_serving
+async def open_http_client():
+    """Create the pooled async HTTP client on the serving event loop"""
+    global http_client
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=ASYNC_STORAGE_THREADS, thread_name_prefix="storage")
+    )
+    http_client = httpx.AsyncClient(
+        timeout=index.KUGOU_API_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=ASYNC_MAX_CONNECTIONS,
+            max_keepalive_connections=ASYNC_MAX_KEEPALIVE
+        )
+    )
+
+
+@app.after_serving
+async def close_http_client():
+    """Close pooled upstream connections on shutdown"""
+    if http_client is not None:
+        await http_client.aclose()
+
+
+async def get_song_from_kugou_api_async(user_id, deadline=NO_DEADLINE):
+    """
+    Async variant of index.get_song_from_kugou_api: the same checks and
+    bookkeeping (index.prepare_kugou_call / finish_kugou_call), awaiting the HTTP call
+    """
+    try:
+        # Storage backends are blocking - keep them off the event loop
+        call = await asyncio.to_thread(index.prepare_kugou_call, user_id, deadline)
+        if call is None:
+            return None
+        kugou_api_url, params, timeout = call
+
+        try:
+            with timed('kugou_api'):
+                data = index.kugou_response_data(await http_client.get(
+                    f"{kugou_api_url}/user/recentListening", params=params, timeout=timeout
+                ))
+        except Exception as e:
+            return index.finish_kugou_call(kugou_api_url, timeout, error=e)[0]
+
+        result, _ = index.finish_kugou_call(kugou_api_url, timeout, data=data)
+        if result:
+            await asyncio.to_thread(index.store_realtime_song, user_id, result, deadline)
+        return result
+
+    except Exception as e:
+        print(f"Error fetching from KuGouMusicApi: {e}")
+        print(traceback.format_exc())
+        trace_step('kugou_api', outcome='error', error=type(e).__name__)
+        return None
+
+
+async def resolve_realtime(user_id, deadline=NO_DEADLINE):
+    """Async variant of index.resolve_realtime"""
+    try:
+        song_data = await async_upstream_flight.do_within(
+            deadline.wait(DEADLINE_RESERVE_SECONDS),
+            ('kugou_api', user_id), get_song_from_kugou_api_async, user_id, deadline
+        )
+    except TimeoutError:
+        trace_step('realtime', skipped='deadline')
+        return None
+    trace_step('realtime', found=bool(song_data))
+    return song_data
+
+
+async def resolve_song(user_id, deadline=NO_DEADLINE):
+    """
+    The now_playing priority chain of index.resolve_song, awaiting the
+    upstream call instead of blocking; the other tiers run in worker threads.
+    Returns (song, tier).
+    """
+    song_data = None
+    tier = 'stale'
+
+    if index.SERVE_MODE == 'stale-while-revalidate':
+        song_data = await asyncio.to_thread(index.resolve_stale, user_id, deadline)
+
+    if not song_data:
+        tier = 'realtime'
+        song_data = await resolve_realtime(user_id, deadline)
+
+    if not song_data and index.storage.available():
+        tier = 'storage'
+        song_data = await asyncio.to_thread(index.resolve_stored, user_id, None, deadline)
+
+    if not song_data and index.storage.available():
+        tier = 'legacy'
+        song_data = await asyncio.to_thread(index.resolve_legacy, user_id, None, deadline)
+
+    return index.resolved(song_data, tier)
+
+
+def svg_response(svg, headers, etag=None):
+    """Quart counterpart of index.svg_response"""
+    body, encoding_headers = as_encoded(svg).negotiate(request.accept_encodings)
+    headers.update(encoding_headers)
+    if etag:
+        headers['ETag'] = f'"{encoded_etag(etag, encoding_headers.get("Content-Encoding"))}"'
+    return Response(body, mimetype='image/svg+xml', headers=headers)
+
+
+def svg_not_modified(headers, matched):
+    """Quart counterpart of index.svg_not_modified"""
+    headers.update(not_modified_headers(matched))
+    return Response(b'', status=304, headers=headers)
+
+
+@app.before_request
+async def start_request_timer():
+    g.request_started = time.perf_counter()
+    start_trace()
+
+
+@app.after_request
+async def observe_request(response):
+    """Quart counterpart of index.observe_request"""
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route=route, status=response.status_code)
+    response.headers.update(server_timing_headers())
+    return response
+
+
+@app.route('/')
+async def now_playing():
+    """Async variant of the main SVG widget endpoint"""
+    try:
+        user_id, theme, width, height, show_album = index.parse_widget_params(request.args)
+        debug = index.trace_requested(request.args, request.headers)
+
+        # Demo mode - time-bucketed rotation, pre-rendered at build time when available
+        if user_id == 'demo' or not user_id:
+            RESPONSES.inc(tier='demo')
+            svg, etag = index.demo_widget(theme, width, height, show_album)
+            max_age = index.demo_seconds_remaining()
+            headers = {
+                'Cache-Control': f'public, max-age={max_age}, s-maxage={max_age}',
+                'Access-Control-Allow-Origin': '*'
+            }
+            matched = matched_etag(request.if_none_match, etag)
+            if matched:
+                return svg_not_modified(headers, matched)
+            return svg_response(svg, headers, etag)
+
+        song_data, _ = await resolve_song(user_id, Deadline())
+
+        headers = {
+            'Cache-Control': 'public, max-age=60',
+            'Access-Control-Allow-Origin': '*'
+        }
+
+        etag = None
+        if song_data:
+            # Rendered when the song was written - no template work on read
+            pushed = index.pushed_widget(user_id, song_data, theme, width, height, show_album)
+            etag = pushed[0] if pushed else index.widget_etag(song_data, theme, width, height, show_album)
+            trace_step('widget', source='pushed' if pushed else 'render')
+
+            # Client already has this rendering - skip SVG generation entirely
+            matched = None if debug else matched_etag(request.if_none_match, etag)
+            if matched:
+                return svg_not_modified(headers, matched)
+
+            svg = pushed[1] if pushed else index.render_song_svg(song_data, theme, width, height, show_album)
+        else:
+            svg = index.default_svg(theme, width, height)
+
+        if debug:
+            response = jsonify(index.trace_report(user_id, song_data, etag))
+            response.headers['Cache-Control'] = 'no-store'
+            response.headers['Access-Control-Allow-Origin'] = '*'
+            return response
+
+        return svg_response(svg, headers, etag)
+
+    except Exception as e:
+        print(f"Error in now_playing: {e}")
+        print(traceback.format_exc())
+
+        try:
+            width = int(request.args.get('width', 400))
+            height = int(request.args.get('height', 120))
+            theme = request.args.get('theme', 'light')
+        except:
+            width, height, theme = 400, 120, 'light'
+
+        return svg_response(index.error_svg(theme, width, height), {
+            'Cache-Control': 'public, max-age=30',
+            'Access-Control-Allow-Origin': '*'
+        })
+
+
+@app.route('/now-playing')
+async def now_playing_json():
+    """Async variant of the JSON now-playing endpoint"""
+    try:
+        user_id = request.args.get('user_id')
+        if not user_id:
+            return jsonify({"error": "Missing required parameter: user_id"}), 400
+
+        if user_id == 'demo':
+            RESPONSES.inc(tier='demo')
+            song_data, tier = index.DEMO_SONGS[index.demo_song_index()], 'demo'
+        else:
+            song_data, tier = await resolve_song(user_id, Deadline())
+        record, etag = index.now_playing_record(user_id, song_data, tier)
+
+        headers = {
+            'Cache-Control': 'public, max-age=60',
+            'Access-Control-Allow-Origin': '*',
+            'ETag': f'W/"{etag}"'
+        }
+        if etag_matches(request.if_none_match, etag):
+            return Response(b'', status=304, headers=headers)
+
+        response = jsonify(record)
+        response.headers.update(headers)
+        return response
+
+    except Exception as e:
+        print(f"Error in now_playing_json: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+def offer_async(updates, event):
+    """Event-loop side of song_events.offer for an asyncio.Queue"""
+    try:
+        updates.get_nowait()
+    except asyncio.QueueEmpty:
+        pass
+    updates.put_nowait(event)
+
+
+@app.route('/events')
+async def song_events_stream():
+    """
+    Async variant of the Server-Sent Events stream: an idle subscriber is a
+    parked coroutine, not a thread
+    """
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Missing required parameter: user_id"}), 400
+    last_event_id = request.headers.get('Last-Event-ID')
+    loop = asyncio.get_running_loop()
+
+    async def stream():
+        updates = asyncio.Queue(maxsize=1)
+        # Publishers run in worker threads - hand events to the loop
+        unsubscribe = index.song_events.subscribe(
+            user_id, lambda event: loop.call_soon_threadsafe(offer_async, updates, event)
+        )
+        index.start_song_watcher()
+        try:
+            yield SSE_RETRY_FRAME.encode('utf-8')
+            event = await asyncio.to_thread(index.current_song_event, user_id)
+            if event and event['id'] != last_event_id:
+                yield sse_frame(event).encode('utf-8')
+
+            ends_at = loop.time() + SSE_MAX_SECONDS
+            while loop.time() < ends_at:
+                try:
+                    event = await asyncio.wait_for(
+                        updates.get(), min(SSE_HEARTBEAT_SECONDS, max(0.0, ends_at - loop.time()))
+                    )
+                except asyncio.TimeoutError:
+                    yield SSE_HEARTBEAT_FRAME.encode('utf-8')
+                    continue
+                yield sse_frame(event).encode('utf-8')
+        finally:
+            unsubscribe()
+
+    response = Response(stream(), content_type='text/event-stream', headers=SSE_HEADERS)
+    # Quart's response timeout would cut the stream short
+    response.timeout = None
+    return response
+
+
+@app.route('/health')
+async def health_check():
+    """Health check endpoint"""
+    return jsonify({
+        "status": "healthy",
+        "firebase_connected": index.storage.name == "firebase" and index.storage.available(),
+        "storage": index.storage.name,
+        "version": "1.0.0",
+        "mode": "asgi"
+    })
+
+
+@app.route('/metrics')
+async def metrics():
+    """Request, stage and upstream metrics in the Prometheus text format (this instance only)"""
+    return Response(render_prometheus(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@app.route('/update', methods=['POST'])
+async def update_now_playing():
+    """Manually update current song"""
+    try:
+        if not index.storage.available():
+            return jsonify({"error": "Storage not configured"}), 500
+
+        data = await request.get_json()
+        user_id = data.get('user_id')
+        song_name = data.get('song_name')
+        artist_name = data.get('artist_name')
+        cover_url = data.get('cover_url', '')
+
+        if not all([user_id, song_name, artist_name]):
+            return jsonify({"error": "Missing required fields: user_id, song_name, artist_name"}), 400
+
+        await asyncio.to_thread(index.save_current_song, user_id, song_name, artist_name, cover_url)
+
+        return jsonify({
+            "success": True,
+            "message": f"Updated current song for {user_id}",
+            "widget_url": f"{request.host_url}?user_id={user_id}"
+        })
+
+    except Exception as e:
+        print(f"Error in update: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/user/<user_id>', methods=['GET'])
+async def get_user_info(user_id):
+    """Get user configuration and current song info"""
+    try:
+        return jsonify(await asyncio.to_thread(index.build_user_info, user_id))
+
+    except Exception as e:
+        print(f"Error in get_user_info: {e}")
+        return jsonify({"error": str(e)}), 500
@@ -0,0 +1,130 @@
+"""
+Circuit breaker
+Tracks consecutive failures per upstream (e.g. a user's KuGouMusicApi URL) and
+stops calling one that keeps failing, so requests fall back immediately
+instead of waiting out its timeout. After a jittered recovery delay a single
+probe call is let through (half-open): success closes the circuit, failure
+re-opens it with a doubled delay.
+"""
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Hashable
+
+# Consecutive failures that open a circuit
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 3))
+
+# First recovery delay (seconds), doubled per failed probe up to the max
+CIRCUIT_RECOVERY_SECONDS = float(os.getenv("CIRCUIT_RECOVERY_SECONDS", 30))
+CIRCUIT_MAX_RECOVERY_SECONDS = float(os.getenv("CIRCUIT_MAX_RECOVERY_SECONDS", 600))
+
+# Recovery delays are spread by +/- this fraction so instances don't probe in lockstep
+CIRCUIT_JITTER = float(os.getenv("CIRCUIT_JITTER", 0.2))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class _Circuit:
+    """Failure state of one upstream"""
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        # Times opened without a successful probe since; sets the backoff
+        self.trips = 0
+        self.retry_at = 0.0
+        self.probe_started = 0.0
+
+
+class CircuitBreaker:
+    """Per-key circuits; callers ask allow() first and report each outcome"""
+
+    def __init__(self, name: str = "circuit_breaker",
+                 failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 recovery_seconds: float = CIRCUIT_RECOVERY_SECONDS,
+                 max_recovery_seconds: float = CIRCUIT_MAX_RECOVERY_SECONDS,
+                 jitter: float = CIRCUIT_JITTER):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.recovery_seconds = recovery_seconds
+        self.max_recovery_seconds = max(recovery_seconds, max_recovery_seconds)
+        self.jitter = jitter
+
+        # Only upstreams with recent failures have an entry
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+        self.rejected = 0
+        self.opened = 0
+        self.probes = 0
+
+    def _recovery_delay(self, trips: int) -> float:
+        delay = min(self.max_recovery_seconds, self.recovery_seconds * 2 ** (trips - 1))
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _open(self, circuit: _Circuit, now: float) -> None:
+        circuit.state = OPEN
+        circuit.trips += 1
+        circuit.retry_at = now + self._recovery_delay(circuit.trips)
+        self.opened += 1
+
+    def allow(self, key: Hashable) -> bool:
+        """Whether to call the upstream now; False means fail fast"""
+        now = time.monotonic()
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None or circuit.state == CLOSED:
+                return True
+
+            # One probe at a time; a probe that never reported is replaced after a recovery period
+            if circuit.state == HALF_OPEN and now - circuit.probe_started < self.recovery_seconds:
+                self.rejected += 1
+                return False
+            if circuit.state == OPEN and now < circuit.retry_at:
+                self.rejected += 1
+                return False
+
+            circuit.state = HALF_OPEN
+            circuit.probe_started = now
+            self.probes += 1
+            return True
+
+    def record_success(self, key: Hashable) -> None:
+        with self._lock:
+            self._circuits.pop(key, None)
+
+    def record_failure(self, key: Hashable) -> None:
+        now = time.monotonic()
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None:
+                circuit = self._circuits[key] = _Circuit()
+
+            if circuit.state == HALF_OPEN:
+                self._open(circuit, now)
+            elif circuit.state == CLOSED:
+                circuit.failures += 1
+                if circuit.failures >= self.failure_threshold:
+                    self._open(circuit, now)
+
+    def state(self, key: Hashable) -> str:
+        with self._lock:
+            circuit = self._circuits.get(key)
+            return circuit.state if circuit else CLOSED
+
+    def stats(self) -> Dict[str, Any]:
+        """Circuit counts by state plus rejected calls and probes"""
+        with self._lock:
+            states = [circuit.state for circuit in self._circuits.values()]
+            return {
+                "name": self.name,
+                "open": states.count(OPEN),
+                "half_open": states.count(HALF_OPEN),
+                "failing": states.count(CLOSED),
+                "opened": self.opened,
+                "rejected": self.rejected,
+                "probes": self.probes
+            }
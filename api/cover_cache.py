@@ -0,0 +1,295 @@
+"""
+Album cover embedding
+Fetches each cover once, downsizes it to the widget's 100x100 slot with Pillow and
+caches it as a data URI (memory + disk), so viewers never hit the image host.
+"""
+import base64
+import hashlib
+import importlib.util
+import ipaddress
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Optional
+from urllib.parse import urljoin, urlsplit
+
+from cache import TTLCache
+from http_session import get_session
+
+# Pillow is optional at runtime - without it covers stay external links.
+# It is only imported when a cover is processed, so cold starts don't pay for it.
+PILLOW_AVAILABLE = importlib.util.find_spec("PIL") is not None
+if not PILLOW_AVAILABLE:
+    print("Pillow not available, album covers will not be embedded")
+
+EMBED_COVERS = os.getenv("EMBED_COVERS", "true").lower() != "false"
+
+# Output size (the SVG <image> slot is 100x100), encoding and quality
+COVER_PIXELS = int(os.getenv("COVER_PIXELS", 100))
+COVER_FORMAT = os.getenv("COVER_FORMAT", "jpeg").lower()
+COVER_QUALITY = int(os.getenv("COVER_QUALITY", 80))
+
+# Disk layer survives warm restarts; /tmp is the writable path on Vercel
+COVER_CACHE_DIR = os.getenv("COVER_CACHE_DIR", "/tmp/kugou-widget-covers")
+COVER_DISK_MAX_FILES = int(os.getenv("COVER_DISK_MAX_FILES", 2000))
+
+# Limits on a cover download. cover_url is user-supplied (/update), so the
+# timeout covers the whole download from before connecting, with no retries.
+# Covers are a few dozen KB and a few hundred pixels across; larger bodies or
+# images are refused.
+COVER_FETCH_TIMEOUT = 5
+COVER_MAX_BYTES = int(os.getenv("COVER_MAX_BYTES", 2 * 1024 * 1024))
+COVER_MAX_PIXELS = int(os.getenv("COVER_MAX_PIXELS", 4096 * 4096))
+COVER_MAX_REDIRECTS = 3
+COVER_FAILURE_TTL = 300
+
+# Only http(s) covers on public addresses are fetched, so /update can't be used
+# to probe the host's own network. Self-hosters serving covers from their LAN can opt out.
+COVER_ALLOW_PRIVATE_HOSTS = os.getenv("COVER_ALLOW_PRIVATE_HOSTS", "false").lower() == "true"
+
+# Some image hosts label covers as generic binary or not at all
+_COVER_CONTENT_TYPES = ("image/", "application/octet-stream")
+
+_MIME_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+
+# cover key -> data URI ("" marks a recent failed fetch)
+_memory = TTLCache(maxsize=int(os.getenv("COVER_CACHE_SIZE", 256)), ttl=24 * 3600, name="covers")
+
+_fetch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cover-fetch")
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def _normalize_url(url: str) -> str:
+    """Kugou image URLs may carry a {size} template segment"""
+    return url.replace("{size}", "240")
+
+
+def cover_key(url: str) -> str:
+    """Content-address a cover by the hash of its URL"""
+    return hashlib.sha256(_normalize_url(url).encode("utf-8")).hexdigest()
+
+
+def _disk_path(key: str) -> str:
+    return os.path.join(COVER_CACHE_DIR, f"{key}.{COVER_FORMAT}")
+
+
+def _to_data_uri(image_bytes: bytes) -> str:
+    mime = _MIME_TYPES.get(COVER_FORMAT, "image/jpeg")
+    return f"data:{mime};base64,{base64.b64encode(image_bytes).decode('ascii')}"
+
+
+def _read_disk(key: str) -> Optional[bytes]:
+    try:
+        with open(_disk_path(key), "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _write_disk(key: str, image_bytes: bytes) -> None:
+    """Store an encoded cover, pruning the oldest files past COVER_DISK_MAX_FILES"""
+    try:
+        os.makedirs(COVER_CACHE_DIR, exist_ok=True)
+        tmp_path = _disk_path(key) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(image_bytes)
+        os.replace(tmp_path, _disk_path(key))
+
+        entries = [e for e in os.scandir(COVER_CACHE_DIR) if e.is_file()]
+        if len(entries) > COVER_DISK_MAX_FILES:
+            entries.sort(key=lambda e: e.stat().st_mtime)
+            for entry in entries[:len(entries) - COVER_DISK_MAX_FILES]:
+                os.remove(entry.path)
+    except OSError as e:
+        print(f"Cover disk cache write failed: {e}")
+
+
+def process_cover(raw: bytes) -> bytes:
+    """Center-crop and downsize a cover to COVER_PIXELS square, then re-encode it compactly"""
+    from PIL import Image, ImageOps
+
+    # Past twice this, Image.open itself refuses the file (decompression bombs)
+    Image.MAX_IMAGE_PIXELS = COVER_MAX_PIXELS
+    with Image.open(BytesIO(raw)) as img:
+        if img.width * img.height > COVER_MAX_PIXELS:
+            raise ValueError(f"Cover too large: {img.width}x{img.height}")
+        # JPEGs decode straight at a reduced scale no smaller than the output
+        img.draft("RGB", (COVER_PIXELS, COVER_PIXELS))
+        img = ImageOps.fit(img.convert("RGB"), (COVER_PIXELS, COVER_PIXELS), Image.LANCZOS)
+        out = BytesIO()
+        img.save(out, format=COVER_FORMAT.upper(), quality=COVER_QUALITY, optimize=True)
+        return out.getvalue()
+
+
+def _check_cover_url(url: str) -> None:
+    """Raise ValueError unless url is http(s) on a host with only public addresses"""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError(f"Cover URL is not http(s): {url}")
+    if COVER_ALLOW_PRIVATE_HOSTS:
+        return
+
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    for *_, sockaddr in socket.getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM):
+        address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        # Loopback, private, link-local, shared and reserved ranges
+        if not address.is_global:
+            raise ValueError(f"Cover host {parts.hostname} is not a public address: {address}")
+
+
+def _open_cover(url: str, started: float):
+    """
+    Streamed response for a cover, following up to COVER_MAX_REDIRECTS redirects
+    and checking every hop with _check_cover_url. Each attempt (single, no
+    retries) gets what is left of COVER_FETCH_TIMEOUT since started.
+    """
+    from urllib3.util import Timeout
+
+    session = get_session(retries=False)
+    for _ in range(COVER_MAX_REDIRECTS + 1):
+        _check_cover_url(url)
+        remaining = COVER_FETCH_TIMEOUT - (time.monotonic() - started)
+        if remaining <= 0:
+            raise TimeoutError(f"Cover download took over {COVER_FETCH_TIMEOUT}s")
+        # total= bounds connect and the wait for headers together
+        response = session.get(url, timeout=Timeout(total=remaining), stream=True, allow_redirects=False)
+        if not response.is_redirect:
+            return response
+        response.close()
+        url = urljoin(url, response.headers["Location"])
+    raise ValueError(f"Cover redirected more than {COVER_MAX_REDIRECTS} times")
+
+
+def read_cover(url: str) -> bytes:
+    """
+    Download a cover's bytes within COVER_FETCH_TIMEOUT in total and
+    COVER_MAX_BYTES; raises on failure, on a URL _check_cover_url refuses,
+    on a non-image Content-Type or past either limit
+    """
+    started = time.monotonic()
+    with _open_cover(_normalize_url(url), started) as response:
+        response.raise_for_status()
+
+        content_type = response.headers.get("Content-Type", "").lower()
+        if content_type and not content_type.startswith(_COVER_CONTENT_TYPES):
+            raise ValueError(f"Cover is not an image: {content_type}")
+        length = response.headers.get("Content-Length", "")
+        if length.isdigit() and int(length) > COVER_MAX_BYTES:
+            raise ValueError(f"Cover too large: {length} bytes")
+
+        # read1 returns after each socket read, so a trickling host can't
+        # stretch one read past the total timeout (urllib3 2; else bounded reads)
+        read = getattr(response.raw, "read1", response.raw.read)
+        chunks = []
+        size = 0
+        while True:
+            chunk = read(64 * 1024, decode_content=True)
+            if not chunk:
+                return b"".join(chunks)
+            size += len(chunk)
+            if size > COVER_MAX_BYTES:
+                raise ValueError(f"Cover too large: over {COVER_MAX_BYTES} bytes")
+            if time.monotonic() - started > COVER_FETCH_TIMEOUT:
+                raise TimeoutError(f"Cover download took over {COVER_FETCH_TIMEOUT}s")
+            chunks.append(chunk)
+
+
+def fetch_cover_data_uri(url: str) -> str:
+    """Download and process a cover synchronously (build scripts; raises on failure)"""
+    return _to_data_uri(process_cover(read_cover(url)))
+
+
+def _download_cover(url: str, key: str) -> Optional[str]:
+    """Download, process and cache one cover; returns its data URI or None on failure"""
+    try:
+        image_bytes = process_cover(read_cover(url))
+        _write_disk(key, image_bytes)
+        data_uri = _to_data_uri(image_bytes)
+        _memory.set(key, data_uri)
+        return data_uri
+    except Exception as e:
+        print(f"Cover fetch failed for {url}: {e}")
+        _memory.set(key, "", ttl=COVER_FAILURE_TTL)
+        return None
+
+
+def _fetch_cover(url: str, key: str) -> None:
+    """Background worker for embedded_cover misses"""
+    try:
+        _download_cover(url, key)
+    finally:
+        with _pending_lock:
+            _pending.discard(key)
+
+
+def covers_enabled() -> bool:
+    """Whether covers are embedded at all (EMBED_COVERS and Pillow installed)"""
+    return EMBED_COVERS and PILLOW_AVAILABLE
+
+
+def _cached_cover(key: str) -> Optional[str]:
+    """Data URI from memory, then disk; "" for a recent failure, None if unknown"""
+    data_uri = _memory.get(key)
+    if data_uri is not None:
+        return data_uri
+
+    image_bytes = _read_disk(key)
+    if image_bytes:
+        data_uri = _to_data_uri(image_bytes)
+        _memory.set(key, data_uri)
+        return data_uri
+    return None
+
+
+def embedded_cover(url: str) -> Optional[str]:
+    """
+    Data URI for a cover if it is already cached (memory, then disk).
+    On a miss the fetch is queued off the request path and None is returned,
+    so the caller renders its placeholder this time.
+    """
+    if not url or not covers_enabled():
+        return None
+    if url.startswith("data:"):
+        return url
+
+    key = cover_key(url)
+    data_uri = _cached_cover(key)
+    if data_uri is not None:
+        return data_uri or None
+
+    with _pending_lock:
+        if key in _pending:
+            return None
+        _pending.add(key)
+    _fetch_executor.submit(_fetch_cover, url, key)
+    return None
+
+
+def embedded_cover_now(url: str) -> Optional[str]:
+    """
+    Like embedded_cover, but a miss is fetched synchronously - for write paths
+    that render ahead of reads and can afford to wait for the image host.
+    """
+    if not url or not covers_enabled():
+        return None
+    if url.startswith("data:"):
+        return url
+
+    key = cover_key(url)
+    data_uri = _cached_cover(key)
+    if data_uri is not None:
+        return data_uri or None
+    return _download_cover(url, key)
+
+
+def cover_cache_stats():
+    """Memory-layer counters for /cache-stats"""
+    stats = _memory.stats()
+    stats["pending_fetches"] = len(_pending)
+    return stats
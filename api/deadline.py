@@ -0,0 +1,52 @@
+"""
+Request deadlines
+A time budget for one widget request, handed down the now_playing fallback
+chain so each upstream call only gets what is left of it. Image proxies such
+as GitHub's give up after a few seconds; a late widget is a broken image.
+"""
+import os
+import time
+from typing import Optional
+
+# Total budget for resolving a song (seconds)
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", 4))
+
+# Held back from KuGouMusicApi so the stored-song read still fits afterwards
+DEADLINE_RESERVE_SECONDS = float(os.getenv("DEADLINE_RESERVE_SECONDS", 0.5))
+
+# Below this, starting another upstream call isn't worth it
+MIN_CALL_SECONDS = 0.05
+
+
+class Deadline:
+    """Point in time a request must answer by; seconds=None means unbounded"""
+
+    def __init__(self, seconds: Optional[float] = REQUEST_DEADLINE_SECONDS):
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return float("inf")
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        """Too little time left to start another call"""
+        return self.remaining() < MIN_CALL_SECONDS
+
+    def timeout(self, cap: float, reserve: float = 0.0) -> float:
+        """Timeout for one call: cap, cut to the remaining budget less reserve"""
+        return max(MIN_CALL_SECONDS, min(cap, self.remaining() - reserve))
+
+    def wait(self, reserve: float = 0.0) -> Optional[float]:
+        """How long to wait on someone else's call: the remaining budget less reserve, None if unbounded"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.remaining() - reserve)
+
+    def can_spend(self, reserve: float = 0.0) -> bool:
+        """Whether a call can start and still leave reserve seconds"""
+        return self.remaining() - reserve >= MIN_CALL_SECONDS
+
+
+# Background work (stale-while-revalidate refreshes, push renders) isn't on a clock
+NO_DEADLINE = Deadline(None)
@@ -0,0 +1,90 @@
+"""
+Shared HTTP session
+Connection-pooled, keep-alive requests session for upstream KuGouMusicApi calls
+"""
+import os
+import threading
+from typing import TYPE_CHECKING
+
+# requests is imported when the first session is built, keeping it off cold starts
+if TYPE_CHECKING:
+    import requests
+
+
+# Number of upstream hosts to keep pools for, and connections kept per host
+POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", 32))
+POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", 10))
+
+# Retries for connection errors and 502/503/504, with exponential backoff.
+# Read timeouts are never retried: a slow upstream would just double the wait.
+# Calls that must fit a deadline use the retries=False session and never retry:
+# each attempt gets the whole timeout, so a retried connect timeout doubles it.
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", 1))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", 0.2))
+
+_sessions = {}
+_session_lock = threading.Lock()
+
+
+def _build_session(retries: bool) -> "requests.Session":
+    """Create a session with pooled keep-alive adapters for http and https"""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=HTTP_RETRIES if retries else 0,
+        connect=HTTP_RETRIES if retries else 0,
+        read=0,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        max_retries=retry
+    )
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({
+        'Accept': 'application/json',
+        'Connection': 'keep-alive'
+    })
+    return session
+
+
+def get_session(retries: bool = True) -> "requests.Session":
+    """
+    Process-wide session, created on first use and reused by warm instances.
+    retries=False gives the single-attempt session for calls bounded by a deadline.
+    """
+    session = _sessions.get(retries)
+    if session is None:
+        with _session_lock:
+            session = _sessions.get(retries)
+            if session is None:
+                session = _sessions[retries] = _build_session(retries)
+    return session
+
+
+def is_timeout(error: Exception) -> bool:
+    """
+    Whether a requests error was a timeout, including ones the retry adapter
+    wrapped; httpx errors (the async entry point) are recognised too
+    """
+    if type(error).__module__.split('.')[0] == 'httpx':
+        import httpx
+        return isinstance(error, httpx.TimeoutException)
+
+    import requests
+    from urllib3.exceptions import TimeoutError as Urllib3Timeout
+
+    if isinstance(error, requests.Timeout):
+        return True
+    # MaxRetryError(reason=ReadTimeoutError) surfaces as requests.ConnectionError
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, Urllib3Timeout)
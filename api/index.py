@@ -2,162 +2,1084 @@
 Main API endpoint for Kugou widget
 Flask serverless function for Vercel
 """
-from flask import Flask, Response, request, jsonify
+from flask import Flask, Response, request, jsonify, g
 import os
 import json
 import traceback
 import time
 import hashlib
+import hmac
+import html
+import queue
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextvars import copy_context
 
 # Add the current directory to path for local imports
 current_dir = os.path.dirname(os.path.abspath(__file__))
 if current_dir not in sys.path:
     sys.path.insert(0, current_dir)
 
-# Import Firebase conditionally to prevent crashes
-firebase_initialized = False
-firebase_admin = None
+# Import local modules. Heavy dependencies (firebase_admin, kugou_client, requests,
+# Pillow) load on first use so cold starts serving demo/static widgets skip them.
 try:
-    import firebase_admin
-    from firebase_admin import credentials, db
-except ImportError as e:
-    print(f"Firebase Admin SDK not available: {e}")
-
-# Import local modules
-print("Loading Kugou client and SVG generator...")
-try:
-    from kugou_client import KugouClient
-    from svg_generator import generate_music_svg, generate_default_svg, generate_error_svg
-    print("Successfully imported local modules")
+    from svg_generator import generate_music_svg, generate_music_svg_bytes, generate_default_svg, generate_error_svg
+    from cache import TTLCache
+    from http_session import get_session, is_timeout
+    from cover_cache import covers_enabled, embedded_cover, embedded_cover_now, cover_cache_stats
+    from svg_output import EncodedSVG, as_encoded, encoded_etag, etag_matches, matched_etag, not_modified_headers
+    from static_widgets import (
+        DEMO_SONGS, DEFAULT_SIZES, SERVICE_ERROR_MESSAGE, THEMES, demo_song_index,
+        demo_seconds_remaining, variant_path, load_variant
+    )
+    from singleflight import SingleFlight
+    from circuit_breaker import CircuitBreaker
+    from deadline import DEADLINE_RESERVE_SECONDS, NO_DEADLINE, REQUEST_DEADLINE_SECONDS, Deadline
+    from song_events import (
+        SSE_HEADERS, SSE_HEARTBEAT_FRAME, SSE_HEARTBEAT_SECONDS, SSE_MAX_SECONDS, SSE_POLL_SECONDS,
+        SSE_RETRY_FRAME, SongEvents, offer, sse_frame
+    )
+    from storage import create_storage
+    from metrics import (
+        PROMETHEUS_CONTENT_TYPE, REQUEST_SECONDS, RESPONSES, UPSTREAM_CALLS, current_trace, end_trace,
+        render_prometheus, server_timing_headers, start_trace, timed, trace_step
+    )
 except Exception as e:
     print(f"ERROR importing local modules: {e}")
     print(f"Current directory: {os.path.dirname(os.path.abspath(__file__))}")
     print(f"sys.path: {sys.path}")
     raise
 
-print("Creating Flask app...")
 app = Flask(__name__)
-print(f"Flask app created successfully")
 
-# Demo song data for immediate testing
-DEMO_SONGS = [
-    {
-        'name': '告白气球',
-        'artist': '周杰伦',
-        'cover': 'https://imge.kugou.com/stdmusic/240/20170418/20170418173403349763.jpg'
-    },
-    {
-        'name': '青花瓷',
-        'artist': '周杰伦', 
-        'cover': 'https://imge.kugou.com/stdmusic/240/20160818/20160818112845056710.jpg'
-    },
-    {
-        'name': '稻香',
-        'artist': '周杰伦',
-        'cover': 'https://imge.kugou.com/stdmusic/240/20150719/20150719205742894772.jpg'
-    }
+# Bump when the widget markup changes so clients drop their cached ETags
+SVG_RENDER_VERSION = "3"
+
+# Rendered SVG cache, keyed on song identity + render parameters
+svg_cache = TTLCache(
+    maxsize=int(os.getenv("SVG_CACHE_SIZE", 512)),
+    ttl=float(os.getenv("SVG_CACHE_TTL", 300)),
+    name="svg"
+)
+
+# Per-user KuGouMusicApi credentials; only change through /setup-kugou
+kugou_creds_cache = TTLCache(
+    maxsize=int(os.getenv("CREDENTIALS_CACHE_SIZE", 1024)),
+    ttl=float(os.getenv("CREDENTIALS_CACHE_TTL", 600)),
+    name="credentials"
+)
+
+# Last song written to users/{user_id}/current_song, for write-only-on-change
+last_song_cache = TTLCache(maxsize=1024, ttl=3600, name="current_song")
+
+# One upstream fetch per user at a time; concurrent widget views share it
+upstream_flight = SingleFlight(name="upstream")
+
+# Per-api_url circuits: views of users whose KuGouMusicApi keeps failing skip
+# straight to the stored song instead of waiting out the request timeout
+upstream_breaker = CircuitBreaker(name="kugou_api")
+
+# Per-call caps on upstream requests; a request's deadline can cut them shorter
+KUGOU_API_TIMEOUT = float(os.getenv("KUGOU_API_TIMEOUT", 10))
+LEGACY_CLIENT_TIMEOUT = float(os.getenv("LEGACY_CLIENT_TIMEOUT", 10))
+
+# A timed-out call counts against its upstream's circuit if it was given at
+# least this long. By default that is half of what a fresh request gives it,
+# so hanging upstreams trip the breaker but calls cut short by an already
+# slow request don't.
+CIRCUIT_TIMEOUT_SECONDS = float(os.getenv(
+    "CIRCUIT_TIMEOUT_SECONDS",
+    min(KUGOU_API_TIMEOUT, REQUEST_DEADLINE_SECONDS - DEADLINE_RESERVE_SECONDS) / 2
+))
+
+# ?trace=1 reports are off unless this is set; a request must then send it in
+# X-Trace-Token (or trace_token). Traces never carry exception text, which can
+# include upstream URLs with tokens, but they do show a user's upstream outcomes.
+TRACE_TOKEN = os.getenv("TRACE_TOKEN", "")
+
+# Minimum seconds between heartbeat-only updated_at refreshes of an unchanged song
+CURRENT_SONG_HEARTBEAT = int(os.getenv("CURRENT_SONG_HEARTBEAT", 300))
+
+# Serving mode: "realtime" calls KuGouMusicApi on the request path;
+# "stale-while-revalidate" serves the last-known song and refreshes it in the background
+SERVE_MODE = os.getenv("SERVE_MODE", "realtime")
+SONG_FRESH_SECONDS = int(os.getenv("SONG_FRESH_SECONDS", 30))
+SONG_STALE_SECONDS = int(os.getenv("SONG_STALE_SECONDS", 3600))
+
+# Last resolved song per user as (song, checked_at), for stale-while-revalidate
+recent_song_cache = TTLCache(maxsize=1024, ttl=SONG_STALE_SECONDS, name="recent_song")
+
+# Background refreshes for stale-while-revalidate. On Vercel a frozen instance
+# finishes pending refreshes on its next invocation; long-running hosts refresh immediately.
+refresh_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SONG_REFRESH_WORKERS", 4)),
+    thread_name_prefix="song-refresh"
+)
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+# Variants rendered when a song is written (/update, a changed real-time song),
+# so reads of them are a keyed lookup; other sizes are rendered on read
+PUSH_RENDER = os.getenv("PUSH_RENDER", "true").lower() != "false"
+PUSH_RENDER_VARIANTS = [
+    (theme, width, height) for theme in THEMES for width, height in DEFAULT_SIZES
 ]
 
-# Current song index (cycles through demo songs)
-current_song_index = 0
+# (user_id, theme, width, height) -> (song identity, etag, EncodedSVG) for pushed renders
+pushed_widgets = TTLCache(maxsize=4096, ttl=SONG_STALE_SECONDS, name="pushed_widgets")
 
-# Initialize Firebase (only if credentials are available and firebase_admin is imported)
-if firebase_admin and os.getenv("FIREBASE_CREDENTIALS"):
+# Batch widget endpoint: users per request and concurrent per-user resolutions
+BATCH_MAX_USERS = int(os.getenv("BATCH_MAX_USERS", 50))
+batch_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("BATCH_WORKERS", 16)),
+    thread_name_prefix="batch"
+)
+
+# User config, credentials and current song (STORAGE_BACKEND, Firebase by default)
+storage = create_storage()
+
+# Storage calls on a request's priority chain run here, so a slow backend can't
+# hold the request past its deadline; an abandoned call finishes in the background
+storage_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("STORAGE_WORKERS", 16)),
+    thread_name_prefix="storage"
+)
+
+# Song changes pushed to /events subscribers, plus the storage watcher feeding
+# them changes written elsewhere (started by the first subscriber)
+song_events = SongEvents()
+_song_watcher = None
+_song_watcher_lock = threading.Lock()
+
+
+def within_deadline(deadline, fn, *args):
+    """
+    fn(*args), a blocking storage call, given at most what is left of deadline.
+    Raises TimeoutError past it; the call itself carries on in storage_executor.
+    Unbounded deadlines (background work) call fn directly.
+    """
+    wait = deadline.wait()
+    if wait is None:
+        return fn(*args)
+    # copy_context: stage timings still land in this request's trace
+    future = storage_executor.submit(copy_context().run, fn, *args)
     try:
-        firebase_creds = json.loads(os.getenv("FIREBASE_CREDENTIALS"))
-        cred = credentials.Certificate(firebase_creds)
-        firebase_admin.initialize_app(cred, {
-            'databaseURL': os.getenv("FIREBASE_DATABASE_URL")
-        })
-        firebase_initialized = True
-        print("Firebase initialized successfully")
+        return future.result(timeout=wait)
+    except FutureTimeout:
+        raise TimeoutError(f"{getattr(fn, '__name__', 'storage call')} outlived the request deadline")
+
+
+def _load_credentials(user_id):
+    # Cache misses as {} too (briefly, since another instance may run /setup-kugou)
+    with timed('credentials_read'):
+        creds = storage.get_credentials(user_id) or {}
+    kugou_creds_cache.set(user_id, creds, ttl=None if creds else 60)
+    return creds
+
+
+def get_kugou_credentials(user_id, deadline=NO_DEADLINE):
+    """Kugou API credentials for a user, served from memory when possible"""
+    creds = kugou_creds_cache.get(user_id)
+    if creds is not None:
+        return creds
+    return within_deadline(deadline, _load_credentials, user_id)
+
+
+def invalidate_kugou_credentials(user_id):
+    """Drop a user's cached credentials after they are written"""
+    kugou_creds_cache.delete(user_id)
+
+
+def _same_song(a, b):
+    """Compare two song records by Kugou hash when both have one, else by fields"""
+    if a.get('hash') and b.get('hash'):
+        return a['hash'] == b['hash']
+    return _song_fields(a) == _song_fields(b)
+
+
+def record_current_song(user_id, song):
+    """
+    Persist the latest real-time song to users/{user_id}/current_song
+    Writes only when the song changed; an unchanged song just gets a
+    rate-limited updated_at heartbeat. Returns True if anything was written.
+    """
+    now = int(time.time())
+    
+    # Last-known song: memory first, then the stored node
+    last = last_song_cache.get(user_id)
+    if last is None:
+        with timed('current_song_read'):
+            last = storage.get_current_song(user_id) or {}
+    
+    if last and _same_song(last, song):
+        if now - last.get('updated_at', 0) < CURRENT_SONG_HEARTBEAT:
+            last_song_cache.set(user_id, last)
+            return False
+        with timed('current_song_write'):
+            storage.update_current_song(user_id, {'updated_at': now})
+        last_song_cache.set(user_id, dict(last, updated_at=now))
+        return True
+    
+    record = {
+        'name': song['name'],
+        'artist': song['artist'],
+        'cover': song['cover'],
+        'updated_at': now,
+        'source': 'kugou_api'
+    }
+    if song.get('hash'):
+        record['hash'] = song['hash']
+    
+    with timed('current_song_write'):
+        storage.set_current_song(user_id, record)
+    last_song_cache.set(user_id, record)
+    publish_song(user_id, record, 'realtime')
+    if PUSH_RENDER:
+        refresh_executor.submit(push_render_stored, user_id, record)
+    return True
+
+
+def remember_song(user_id, song):
+    """Record the latest resolved song for stale-while-revalidate serving"""
+    recent_song_cache.set(user_id, (song, time.time()))
+
+
+def refresh_song(user_id):
+    """Background worker: re-fetch a user's song from KuGouMusicApi"""
+    try:
+        _, outcome = upstream_flight.do(('kugou_api', user_id), fetch_kugou_song, user_id)
+        # A found song was remembered when stored. Only an upstream that answered
+        # "nothing newer" confirms the one we have; after errors, open circuits or
+        # skipped calls it keeps its old checked_at, so SONG_STALE_SECONDS still applies.
+        if outcome == 'empty':
+            entry = recent_song_cache.get(user_id)
+            if entry:
+                remember_song(user_id, entry[0])
     except Exception as e:
-        print(f"Firebase initialization failed: {e}")
-        firebase_initialized = False
-else:
-    print("Firebase not available or credentials not set - using demo mode only")
+        print(f"Background refresh failed for {user_id}: {e}")
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(user_id)
+
+
+def schedule_song_refresh(user_id):
+    """Queue a background refresh unless one is already pending for this user"""
+    with _refreshing_lock:
+        if user_id in _refreshing:
+            return
+        _refreshing.add(user_id)
+    refresh_executor.submit(refresh_song, user_id)
+
+
+def _load_stale_entry(user_id):
+    with timed('stale_read'):
+        stored = storage.get_current_song(user_id)
+    if not stored:
+        return None
+    entry = (stored, stored.get('updated_at', 0))
+    recent_song_cache.set(user_id, entry)
+    return entry
+
+
+def get_song_stale_while_revalidate(user_id, deadline=NO_DEADLINE):
+    """
+    Serve the last-known song immediately (memory, then the stored current_song)
+    and refresh it in the background once it is older than SONG_FRESH_SECONDS.
+    Returns None when nothing within SONG_STALE_SECONDS is known.
+    """
+    entry = recent_song_cache.get(user_id)
+    
+    if entry is None and storage.available():
+        try:
+            entry = within_deadline(deadline, _load_stale_entry, user_id)
+        except Exception as e:
+            print(f"{storage.name} lookup failed: {e}")
+    
+    if entry is None:
+        return None
+    
+    song, checked_at = entry
+    age = time.time() - checked_at
+    if age > SONG_STALE_SECONDS:
+        return None
+    if age > SONG_FRESH_SECONDS:
+        schedule_song_refresh(user_id)
+    return song
+
+
+def parse_recent_listening(data):
+    """Turn a KuGouMusicApi /user/recentListening payload into a song record"""
+    if data.get('status') == 1 and data.get('data') and len(data['data']) > 0:
+        song = data['data'][0]
+        return {
+            'name': song.get('songname', 'Unknown'),
+            'artist': song.get('singername', 'Unknown'),
+            'cover': song.get('img', ''),
+            'hash': song.get('hash'),
+            'source': 'kugou_api_realtime'
+        }
+    return None
+
+
+def store_realtime_song(user_id, result, deadline=NO_DEADLINE):
+    """Remember a fresh real-time song and update the stored current song if it changed"""
+    remember_song(user_id, result)
+    
+    try:
+        if within_deadline(deadline, record_current_song, user_id, result):
+            print(f"Updated {storage.name} current song for {user_id}")
+    except TimeoutError:
+        # The song is in hand - let the write finish after the response
+        print(f"{storage.name} write for {user_id} continues past the request deadline")
+    except Exception as cache_error:
+        print(f"Cache update failed: {cache_error}")
+
+
+def prepare_kugou_call(user_id, deadline=NO_DEADLINE):
+    """
+    Checks ahead of a KuGouMusicApi call: the user's credentials, the
+    api_url's circuit and what is left of deadline. Returns (api_url, params,
+    timeout) for the /user/recentListening call, or None to skip it.
+    The timeout leaves DEADLINE_RESERVE_SECONDS of the deadline for the stored-song read.
+    """
+    if not storage.available():
+        return None
+    
+    # Get user's Kugou credentials (cached, falls back to storage)
+    try:
+        creds = get_kugou_credentials(user_id, deadline)
+    except TimeoutError:
+        trace_step('kugou_api', outcome='deadline', stage='credentials_read')
+        return None
+    
+    if not creds:
+        print(f"No Kugou API credentials found for {user_id}")
+        trace_step('kugou_api', outcome='no_credentials')
+        return None
+    
+    kugou_api_url = creds.get('api_url')
+    userid = creds.get('userid')
+    token = creds.get('token')
+    
+    if not kugou_api_url or not userid or not token:
+        print("Incomplete Kugou API credentials")
+        trace_step('kugou_api', outcome='incomplete_credentials')
+        return None
+    
+    if not deadline.can_spend(DEADLINE_RESERVE_SECONDS):
+        trace_step('kugou_api', outcome='deadline')
+        return None
+    
+    # Asked last: a half-open circuit's probe must go on to make the call and report back
+    if not upstream_breaker.allow(kugou_api_url):
+        print(f"Circuit open for {kugou_api_url}, skipping KuGouMusicApi")
+        UPSTREAM_CALLS.inc(outcome='circuit_open')
+        trace_step('kugou_api', outcome='circuit_open')
+        return None
+    
+    params = {
+        'userid': userid,
+        'token': token,
+        'limit': 1
+    }
+    return kugou_api_url, params, deadline.timeout(KUGOU_API_TIMEOUT, DEADLINE_RESERVE_SECONDS)
+
+
+def kugou_response_data(response):
+    """JSON body of a KuGouMusicApi response (requests or httpx); a 5xx counts as a failed call"""
+    if response.status_code >= 500:
+        raise RuntimeError(f"KuGouMusicApi returned HTTP {response.status_code}")
+    return response.json()
+
+
+def finish_kugou_call(kugou_api_url, timeout, data=None, error=None):
+    """
+    Book a KuGouMusicApi call with the circuit breaker, metrics and trace:
+    data is its JSON body, or error what it raised. Returns (song, outcome),
+    song None unless the upstream reported one.
+    """
+    if error is not None:
+        # A call squeezed into a nearly spent deadline says little about the upstream's health
+        if timeout >= CIRCUIT_TIMEOUT_SECONDS or not is_timeout(error):
+            upstream_breaker.record_failure(kugou_api_url)
+        print(f"Error fetching from KuGouMusicApi: {error}")
+        UPSTREAM_CALLS.inc(outcome='error')
+        trace_step('kugou_api', outcome='error', error=type(error).__name__)
+        return None, 'error'
+    
+    upstream_breaker.record_success(kugou_api_url)
+    print(f"KuGouMusicApi response status: {data.get('status')}")
+    
+    # Check if we got song data
+    result = parse_recent_listening(data)
+    outcome = 'ok' if result else 'empty'
+    UPSTREAM_CALLS.inc(outcome=outcome)
+    trace_step('kugou_api', outcome=outcome)
+    if result:
+        print(f"✅ Got real-time song from Kugou: {result['name']} - {result['artist']}")
+    else:
+        print(f"No songs in KuGouMusicApi response")
+    return result, outcome
 
 
-def get_song_from_kugou_api(user_id):
+def get_song_from_kugou_api(user_id, deadline=NO_DEADLINE):
     """
     Fetch currently playing song from Node.js KuGouMusicApi
     This provides real-time sync with actual Kugou listening history
     """
+    return fetch_kugou_song(user_id, deadline)[0]
+
+
+def fetch_kugou_song(user_id, deadline=NO_DEADLINE):
+    """
+    get_song_from_kugou_api plus how the call went: (song, outcome), outcome
+    'ok', 'empty' (the upstream answered without a song), 'error' or 'skipped'
+    (no credentials, open circuit, no time left)
+    """
     try:
-        if not firebase_initialized:
-            return None
-            
-        # Get user's Kugou credentials from Firebase
-        ref = db.reference(f'users/{user_id}/kugou_credentials')
-        creds = ref.get()
-        
-        if not creds:
-            print(f"No Kugou API credentials found for {user_id}")
-            return None
-        
-        kugou_api_url = creds.get('api_url')
-        userid = creds.get('userid')
-        token = creds.get('token')
-        
-        if not kugou_api_url or not userid or not token:
-            print("Incomplete Kugou API credentials")
-            return None
+        call = prepare_kugou_call(user_id, deadline)
+        if call is None:
+            return None, 'skipped'
+        kugou_api_url, params, timeout = call
         
-        # Call Node.js KuGouMusicApi for listening history
+        # Call Node.js KuGouMusicApi for listening history; a request's call
+        # gets a single attempt, since a retry would run past its deadline
         print(f"Fetching from KuGouMusicApi: {kugou_api_url}")
+        try:
+            with timed('kugou_api'):
+                data = kugou_response_data(get_session(retries=deadline.expires_at is None).get(
+                    f"{kugou_api_url}/user/recentListening", params=params, timeout=timeout
+                ))
+        except Exception as e:
+            return finish_kugou_call(kugou_api_url, timeout, error=e)
         
-        import requests
-        response = requests.get(
-            f"{kugou_api_url}/user/recentListening",
-            params={
-                'userid': userid,
-                'token': token,
-                'limit': 1
-            },
-            timeout=10
+        result, outcome = finish_kugou_call(kugou_api_url, timeout, data=data)
+        if result:
+            # Update the stored current song (only when it changed)
+            store_realtime_song(user_id, result, deadline)
+        return result, outcome
+    
+    except Exception as e:
+        print(f"Error fetching from KuGouMusicApi: {e}")
+        print(traceback.format_exc())
+        trace_step('kugou_api', outcome='error', error=type(e).__name__)
+        return None, 'error'
+
+
+def get_song_from_legacy_client(user_id, user_data=None, deadline=NO_DEADLINE):
+    """Fetch listening history through the legacy direct KugouClient"""
+    if user_data is None:
+        user_data = within_deadline(deadline, storage.get_user, user_id)
+    if not (user_data and user_data.get('userid') and user_data.get('token')):
+        return None
+    
+    print("Trying legacy KugouClient...")
+    from kugou_client import KugouClient
+    client = KugouClient(
+        userid=user_data.get('userid'),
+        token=user_data.get('token'),
+        dfid=user_data.get('dfid'),
+        mid=user_data.get('mid'),
+        uuid=user_data.get('uuid')
+    )
+    with timed('legacy_client'):
+        return client.get_user_listening_history(timeout=deadline.timeout(LEGACY_CLIENT_TIMEOUT))
+
+
+def _read_current_song(user_id):
+    with timed('cached_song_read'):
+        return storage.get_current_song(user_id)
+
+
+def read_cached_song(user_id, deadline=NO_DEADLINE):
+    """Last song stored in users/{user_id}/current_song, or None; TimeoutError past deadline"""
+    try:
+        song_data = within_deadline(deadline, _read_current_song, user_id)
+        if song_data:
+            print(f"Using cached {storage.name} data for {user_id}")
+        return song_data
+    except TimeoutError:
+        raise
+    except Exception as e:
+        print(f"{storage.name} lookup failed: {e}")
+        return None
+
+
+def remembered_song(user_id):
+    """Last song this instance resolved or wrote for a user, without a storage read"""
+    entry = recent_song_cache.get(user_id)
+    if entry:
+        return entry[0]
+    return last_song_cache.get(user_id)
+
+
+def prime_user_caches(user_id, user_data):
+    """Seed the per-user caches from a users/{user_id} node read in bulk"""
+    if kugou_creds_cache.get(user_id) is None:
+        creds = user_data.get('kugou_credentials') or {}
+        kugou_creds_cache.set(user_id, creds, ttl=None if creds else 60)
+    
+    stored = user_data.get('current_song')
+    if SERVE_MODE == 'stale-while-revalidate' and stored and recent_song_cache.get(user_id) is None:
+        recent_song_cache.set(user_id, (stored, stored.get('updated_at', 0)))
+
+
+def resolve_stale(user_id, deadline=NO_DEADLINE):
+    """PRIORITY 0 (stale-while-revalidate): the last-known song, refreshed in the background"""
+    song_data = get_song_stale_while_revalidate(user_id, deadline)
+    trace_step('stale', found=bool(song_data))
+    if song_data:
+        print(f"Using last-known song for {user_id} (stale-while-revalidate)")
+    return song_data
+
+
+def resolve_realtime(user_id, deadline=NO_DEADLINE):
+    """PRIORITY 1: KuGouMusicApi, one fetch per user at a time"""
+    try:
+        # Joining another request's fetch: wait only as long as our own budget allows
+        song_data, _ = upstream_flight.do_within(
+            deadline.wait(DEADLINE_RESERVE_SECONDS),
+            ('kugou_api', user_id), fetch_kugou_song, user_id, deadline
         )
+    except TimeoutError:
+        trace_step('realtime', skipped='deadline')
+        return None
+    trace_step('realtime', found=bool(song_data))
+    if song_data:
+        print(f"✅ Using real-time KuGouMusicApi data")
+    return song_data
+
+
+def resolve_stored(user_id, user_data=None, deadline=NO_DEADLINE):
+    """PRIORITY 2: the song stored in users/{user_id}/current_song"""
+    if user_data is not None:
+        song_data = user_data.get('current_song')
+    else:
+        try:
+            if deadline.expired():
+                raise TimeoutError("no time left for a storage read")
+            song_data = read_cached_song(user_id, deadline)
+        except TimeoutError:
+            # No time for a storage round trip - this instance's last-known song, if any
+            song_data = remembered_song(user_id)
+            trace_step('storage', skipped='deadline', remembered=bool(song_data))
+    trace_step('storage', found=bool(song_data))
+    return song_data
+
+
+def resolve_legacy(user_id, user_data=None, deadline=NO_DEADLINE):
+    """PRIORITY 3: the old direct KugouClient, when the deadline still allows it"""
+    if deadline.expired():
+        trace_step('legacy', skipped='deadline')
+        return None
+    try:
+        song_data = upstream_flight.do_within(
+            deadline.wait(),
+            ('legacy', user_id), get_song_from_legacy_client, user_id, user_data, deadline
+        )
+    except Exception as e:
+        print(f"Legacy Kugou API call failed: {e}")
+        trace_step('legacy', error=type(e).__name__)
+        return None
+    trace_step('legacy', found=bool(song_data))
+    return song_data
+
+
+def resolved(song_data, tier):
+    """
+    End of the priority chain: the demo song when no tier found one.
+    Returns (song, tier), counting the tier in widget_responses_total.
+    """
+    if not song_data:
+        tier = 'fallback'
+        song_data = DEMO_SONGS[0]
+        print("Using fallback demo song")
+    
+    RESPONSES.inc(tier=tier)
+    trace_step('resolved', tier=tier)
+    return song_data, tier
+
+
+def resolve_song(user_id, user_data=None, deadline=NO_DEADLINE):
+    """
+    The now_playing priority chain for a real user. user_data is the
+    users/{user_id} node when already read (batch requests), else it is read per step.
+    Each tier gets only what is left of deadline; tiers that no longer fit
+    are skipped, keeping the best answer found so far.
+    Returns (song, tier). The tier that supplied the song is counted in
+    widget_responses_total, and every tier tried is recorded in the request trace.
+    """
+    song_data = None
+    tier = 'stale'
+    
+    if SERVE_MODE == 'stale-while-revalidate':
+        song_data = resolve_stale(user_id, deadline)
+    
+    if not song_data:
+        tier = 'realtime'
+        song_data = resolve_realtime(user_id, deadline)
+    
+    if not song_data and storage.available():
+        tier = 'storage'
+        song_data = resolve_stored(user_id, user_data, deadline)
+    
+    if not song_data and storage.available():
+        tier = 'legacy'
+        song_data = resolve_legacy(user_id, user_data, deadline)
+    
+    return resolved(song_data, tier)
+
+
+def resolve_songs(user_ids, deadline=NO_DEADLINE):
+    """
+    resolve_song for many users: their nodes are read up front (one query
+    where the backend has a bulk read, concurrent per-user reads on
+    batch_executor otherwise), then the upstream fetches run concurrently
+    within one shared deadline. Returns {user_id: (song, tier)}.
+    """
+    users = {}
+    if storage.available():
+        try:
+            users = within_deadline(deadline, storage.get_users, user_ids, batch_executor)
+            for user_id, user_data in users.items():
+                prime_user_caches(user_id, user_data)
+        except Exception as e:
+            # Fall back to per-user reads
+            print(f"Batch {storage.name} read failed: {e}")
+            users = {}
+    
+    songs = batch_executor.map(lambda user_id: resolve_song(user_id, users.get(user_id), deadline), user_ids)
+    return dict(zip(user_ids, songs))
+
+
+def save_current_song(user_id, song_name, artist_name, cover_url):
+    """Manually set a user's current song (the /update write path)"""
+    record = {
+        'name': song_name,
+        'artist': artist_name,
+        'cover': cover_url,
+        'updated_at': int(time.time())
+    }
+    if PUSH_RENDER:
+        record['rendered'] = push_render(user_id, record)
+    storage.set_current_song(user_id, record)
+    last_song_cache.set(user_id, record)
+    remember_song(user_id, record)
+    publish_song(user_id, record, 'storage')
+    return record
+
+
+def song_event(user_id, song_data, tier):
+    """
+    (song key, event) for /events: the /now-playing record, identified by the
+    song alone - not the record's ETag, which changes with the tier it came from
+    """
+    record, _ = now_playing_record(user_id, song_data, tier)
+    return _song_identity(song_data), {"id": _song_digest(song_data), "data": record}
+
+
+def publish_song(user_id, song_data, tier):
+    """Push a written song to the user's /events subscribers, if any"""
+    if song_events.has_subscribers(user_id):
+        song_events.publish(user_id, *song_event(user_id, song_data, tier))
+
+
+def current_song_event(user_id):
+    """Starting event for a new subscriber: the latest pushed one, else the stored song (None if none)"""
+    event = song_events.latest(user_id)
+    if event is not None:
+        return event
+    song_data = remembered_song(user_id) or (read_cached_song(user_id) if storage.available() else None)
+    if not song_data:
+        return None
+    return song_events.seed(user_id, *song_event(user_id, song_data, 'storage'))
+
+
+def watch_stored_songs():
+    """Background: re-read subscribed users' stored songs, publishing ones changed by other writers"""
+    def check(user_id):
+        try:
+            song_data = storage.get_current_song(user_id)
+            if song_data:
+                publish_song(user_id, song_data, 'storage')
+        except Exception as e:
+            print(f"Song watch failed for {user_id}: {e}")
+    
+    while True:
+        time.sleep(SSE_POLL_SECONDS)
+        user_ids = song_events.watched()
+        if user_ids and storage.available():
+            # One read per watched user, however many subscribers it has
+            list(batch_executor.map(check, user_ids))
+
+
+def start_song_watcher():
+    global _song_watcher
+    if _song_watcher is None:
+        with _song_watcher_lock:
+            if _song_watcher is None:
+                _song_watcher = threading.Thread(target=watch_stored_songs, name="song-watcher", daemon=True)
+                _song_watcher.start()
+
+
+def song_event_stream(user_id, last_event_id=None):
+    """
+    text/event-stream frames for one subscriber: the current song (unless the
+    client already has it), then one event per change, with heartbeats, until SSE_MAX_SECONDS
+    """
+    updates = queue.Queue(maxsize=1)
+    unsubscribe = song_events.subscribe(user_id, lambda event: offer(updates, event))
+    start_song_watcher()
+    try:
+        yield SSE_RETRY_FRAME
+        event = current_song_event(user_id)
+        if event and event['id'] != last_event_id:
+            yield sse_frame(event)
         
-        data = response.json()
-        print(f"KuGouMusicApi response status: {data.get('status')}")
-        
-        # Check if we got song data
-        if data.get('status') == 1 and data.get('data') and len(data['data']) > 0:
-            song = data['data'][0]
-            
-            result = {
-                'name': song.get('songname', 'Unknown'),
-                'artist': song.get('singername', 'Unknown'),
-                'cover': song.get('img', ''),
-                'hash': song.get('hash'),
-                'source': 'kugou_api_realtime'
-            }
-            
-            print(f"✅ Got real-time song from Kugou: {result['name']} - {result['artist']}")
-            
-            # Update Firebase cache with latest song
+        ends_at = time.monotonic() + SSE_MAX_SECONDS
+        while time.monotonic() < ends_at:
             try:
-                song_ref = db.reference(f'users/{user_id}/current_song')
-                song_ref.set({
-                    'name': result['name'],
-                    'artist': result['artist'],
-                    'cover': result['cover'],
-                    'updated_at': int(time.time()),
-                    'source': 'kugou_api'
-                })
-                print(f"Updated Firebase cache for {user_id}")
-            except Exception as cache_error:
-                print(f"Cache update failed: {cache_error}")
-            
-            return result
-        else:
-            print(f"No songs in KuGouMusicApi response")
-            return None
+                event = updates.get(timeout=min(SSE_HEARTBEAT_SECONDS, max(0.0, ends_at - time.monotonic())))
+            except queue.Empty:
+                yield SSE_HEARTBEAT_FRAME
+                continue
+            yield sse_frame(event)
+    finally:
+        unsubscribe()
+
+
+def build_user_info(user_id):
+    """User configuration and current song info, as served by /user/<user_id>"""
+    if not storage.available():
+        return {
+            "user_id": user_id,
+            "mode": "demo" if user_id == "demo" else "no_firebase",
+            "firebase_connected": False
+        }
+    
+    user_data = storage.get_user(user_id)
+    
+    if not user_data:
+        return {
+            "user_id": user_id,
+            "mode": "not_configured",
+            "message": "User not found in database"
+        }
+    
+    # Check token expiration
+    expires_at = user_data.get('expires_at', 0)
+    current_time = int(time.time() * 1000)
+    is_expired = current_time >= expires_at
+    
+    # Current song comes with the user node
+    current_song = user_data.get('current_song')
+    if current_song:
+        current_song.pop('rendered', None)
+    
+    return {
+        "user_id": user_id,
+        "mode": "configured",
+        "has_credentials": bool(user_data.get('userid') and user_data.get('token')),
+        "token_expired": is_expired,
+        "expires_at": expires_at,
+        "current_time": current_time,
+        "current_song": current_song,
+        "last_updated": current_song.get('updated_at') if current_song else None
+    }
+
+
+def now_playing_record(user_id, song_data, tier):
+    """
+    Body of /now-playing and its (weak) ETag: the resolved song, the tier that
+    supplied it, when it was stored (updated_at) and when an upstream last
+    confirmed it (checked_at, realtime and stale tiers)
+    """
+    name, artist, cover = _song_fields(song_data)
+    record = {
+        "user_id": user_id,
+        "song": {
+            "name": name,
+            "artist": artist,
+            "cover": cover,
+            "hash": song_data.get('hash')
+        },
+        "tier": tier,
+        "source": song_data.get('source'),
+        "updated_at": song_data.get('updated_at')
+    }
+    # checked_at moves on every upstream confirmation - leave it out of the validator
+    etag = hashlib.sha1(json.dumps(record, sort_keys=True).encode('utf-8')).hexdigest()
+    
+    entry = recent_song_cache.get(user_id) if tier in ('realtime', 'stale') else None
+    record["checked_at"] = int(entry[1]) if entry else None
+    return record, etag
+
+
+def parse_widget_params(args):
+    """Widget query parameters: (user_id, theme, width, height, show_album)"""
+    return (
+        args.get('user_id'),
+        args.get('theme', 'light'),
+        int(args.get('width', 400)),
+        int(args.get('height', 120)),
+        args.get('show_album', 'true').lower() != 'false'
+    )
+
+
+def _song_fields(song_data):
+    """Normalize name/artist/cover across KuGouMusicApi, Firebase and legacy payloads"""
+    return (
+        song_data.get('name', song_data.get('song_name', 'Unknown')),
+        song_data.get('artist', song_data.get('author_name', 'Unknown')),
+        song_data.get('cover', song_data.get('img', ''))
+    )
+
+
+def _song_identity(song_data):
+    """Stable identity for a resolved song: the Kugou hash, else name/artist/cover"""
+    if song_data.get('hash'):
+        return ('hash', song_data['hash'])
+    return ('meta',) + _song_fields(song_data)
+
+
+def _song_digest(song_data):
+    """_song_identity as a string, for storing or sending alongside a song"""
+    return hashlib.sha1(repr(_song_identity(song_data)).encode('utf-8')).hexdigest()
+
+
+def _cover_href(song_data, show_album):
+    """
+    Cover to render: the embedded data URI once cached, '' (placeholder) while
+    it is fetched in the background, or the original URL if embedding is off
+    """
+    cover = _song_fields(song_data)[2]
+    if not show_album or not cover or not covers_enabled():
+        return cover
+    return embedded_cover(cover) or ''
+
+
+def _render_key(song_data, theme, width, height, show_album, cover_href=None):
+    """Cache/ETag key for one rendering of a resolved song"""
+    if cover_href is None:
+        cover_href = _cover_href(song_data, show_album)
+    cover_state = 'embedded' if cover_href.startswith('data:') else ('linked' if cover_href else 'placeholder')
+    return (_song_identity(song_data), theme, width, height, show_album, cover_state)
+
+
+def widget_etag(song_data, theme, width, height, show_album):
+    """Strong ETag for a widget rendering, computed without rendering it"""
+    key = (SVG_RENDER_VERSION,) + _render_key(song_data, theme, width, height, show_album)
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+def render_song_svg(song_data, theme, width, height, show_album):
+    """Render (or reuse) the SVG body, with its compressed variants, for a resolved song"""
+    cover_href = _cover_href(song_data, show_album)
+    cache_key = _render_key(song_data, theme, width, height, show_album, cover_href)
+    svg = svg_cache.get(cache_key)
+    if svg is not None:
+        return svg
+
+    song_name, artist_name, _ = _song_fields(song_data)
+    with timed('render'):
+        svg = EncodedSVG(generate_music_svg_bytes(
+            song_name=song_name,
+            artist_name=artist_name,
+            album_cover_url=cover_href,
+            theme=theme,
+            width=width,
+            height=height,
+            show_album=show_album
+        ))
+    svg_cache.set(cache_key, svg)
+    return svg
+
+
+def _pushed_name(theme, width, height):
+    """Key of a pushed variant under current_song/rendered"""
+    return f"{theme}-{width}x{height}"
+
+
+def push_render(user_id, song_data):
+    """
+    Render the PUSH_RENDER_VARIANTS of a newly written song, waiting for its
+    cover so the stored widgets are final. Returns them as stored beside the song:
+    {variant: {"etag", "svg", "version", "song"}}, song being the _song_digest
+    they were rendered for.
+    """
+    cover = _song_fields(song_data)[2]
+    if cover:
+        embedded_cover_now(cover)
+    identity = _song_identity(song_data)
+    digest = _song_digest(song_data)
+    
+    if cover and not _cover_href(song_data, True):
+        # Cover unavailable right now - leave rendering to the read path
+        return {}
     
+    rendered = {}
+    for theme, width, height in PUSH_RENDER_VARIANTS:
+        etag = widget_etag(song_data, theme, width, height, True)
+        svg = render_song_svg(song_data, theme, width, height, True)
+        pushed_widgets.set((user_id, theme, width, height), (identity, etag, svg))
+        rendered[_pushed_name(theme, width, height)] = {
+            'etag': etag,
+            'svg': svg.body.decode('utf-8'),
+            'version': SVG_RENDER_VERSION,
+            'song': digest
+        }
+    return rendered
+
+
+def push_render_stored(user_id, record):
+    """Background: push-render a song record_current_song wrote and store the widgets beside it"""
+    try:
+        with timed('push_render'):
+            rendered = push_render(user_id, record)
+        # Skip the write if a newer song replaced this one meanwhile. Another
+        # instance may still have; pushed_widget checks each entry's song.
+        latest = last_song_cache.get(user_id)
+        if rendered and latest and _same_song(latest, record):
+            storage.update_current_song(user_id, {'rendered': rendered})
     except Exception as e:
-        print(f"Error fetching from KuGouMusicApi: {e}")
-        print(traceback.format_exc())
+        print(f"Push render failed for {user_id}: {e}")
+
+
+def pushed_widget(user_id, song_data, theme, width, height, show_album):
+    """
+    (etag, EncodedSVG) rendered for this song when it was written, or None.
+    Checks this instance's pushed renders, then the copy stored in current_song.
+    """
+    if not show_album:
+        return None
+    
+    key = (user_id, theme, width, height)
+    identity = _song_identity(song_data)
+    entry = pushed_widgets.get(key)
+    if entry and entry[0] == identity:
+        return entry[1], entry[2]
+    
+    stored = (song_data.get('rendered') or {}).get(_pushed_name(theme, width, height))
+    if not stored or stored.get('version') != SVG_RENDER_VERSION:
+        return None
+    # A late push from another writer can land beside a newer song
+    if stored.get('song') != _song_digest(song_data):
         return None
+    svg = EncodedSVG(stored['svg'])
+    pushed_widgets.set(key, (identity, stored['etag'], svg))
+    return stored['etag'], svg
+
+
+def demo_widget(theme, width, height, show_album):
+    """Current demo widget as (EncodedSVG, etag): the pre-rendered file when built, else rendered"""
+    index = demo_song_index()
+    variant = load_variant(variant_path('demo', theme, width, height, show_album, index))
+    if variant:
+        return variant
+    
+    song_data = DEMO_SONGS[index]
+    return (
+        render_song_svg(song_data, theme, width, height, show_album),
+        widget_etag(song_data, theme, width, height, show_album)
+    )
+
+
+def default_svg(theme, width, height):
+    """Not-playing widget, pre-rendered when built"""
+    variant = load_variant(variant_path('default', theme, width, height))
+    return variant[0] if variant else EncodedSVG(generate_default_svg(theme, width, height))
+
+
+def error_svg(theme, width, height):
+    """Service error widget, pre-rendered when built"""
+    variant = load_variant(variant_path('error', theme, width, height))
+    return variant[0] if variant else EncodedSVG(generate_error_svg(SERVICE_ERROR_MESSAGE, theme, width, height))
+
+
+def svg_response(svg, headers, etag=None):
+    """SVG response encoded per Accept-Encoding (ETag suffixed per coding)"""
+    body, encoding_headers = as_encoded(svg).negotiate(request.accept_encodings)
+    headers.update(encoding_headers)
+    if etag:
+        headers['ETag'] = f'"{encoded_etag(etag, encoding_headers.get("Content-Encoding"))}"'
+    return Response(body, mimetype='image/svg+xml', headers=headers)
+
+
+def svg_not_modified(headers, matched):
+    """304 for an SVG route, carrying the coding-specific ETag that matched and Vary"""
+    headers.update(not_modified_headers(matched))
+    return Response(status=304, headers=headers)
+
+
+def sprite_svg(widgets, width, height):
+    """Stack rendered widgets (user_id, svg bytes) into one SVG, each addressable by id"""
+    parts = [
+        f'<svg width="{width}" height="{height * len(widgets)}" '
+        f'xmlns="http://www.w3.org/2000/svg">'.encode('utf-8')
+    ]
+    for offset, (user_id, svg) in enumerate(widgets):
+        position = f'<svg id="{html.escape(user_id)}" y="{offset * height}" '.encode('utf-8')
+        parts.append(svg.replace(b'<svg ', position, 1))
+    parts.append(b'</svg>')
+    return b''.join(parts)
+
+
+def demo_response(theme, width, height, show_album):
+    """Demo widget, cacheable (browsers and Vercel's edge) until the demo rotates"""
+    RESPONSES.inc(tier='demo')
+    svg, etag = demo_widget(theme, width, height, show_album)
+    max_age = demo_seconds_remaining()
+    headers = {
+        'Cache-Control': f'public, max-age={max_age}, s-maxage={max_age}',
+        'Access-Control-Allow-Origin': '*'
+    }
+    matched = matched_etag(request.if_none_match, etag)
+    if matched:
+        return svg_not_modified(headers, matched)
+    return svg_response(svg, headers, etag)
+
+
+def trace_requested(args, headers):
+    """Whether a widget request asked for its ?trace=1 report and holds TRACE_TOKEN"""
+    if not TRACE_TOKEN or args.get('trace') != '1':
+        return False
+    token = headers.get('X-Trace-Token') or args.get('trace_token') or ''
+    return hmac.compare_digest(token.encode('utf-8'), TRACE_TOKEN.encode('utf-8'))
+
+
+def trace_report(user_id, song_data, etag):
+    """Body of a ?trace=1 widget request: the priority-chain decisions and stage timings"""
+    name, artist, cover = _song_fields(song_data) if song_data else (None, None, None)
+    return dict(current_trace().as_dict(), user_id=user_id, etag=etag, song={
+        "name": name,
+        "artist": artist,
+        "cover": cover,
+        "source": song_data.get('source') if song_data else None,
+        "updated_at": song_data.get('updated_at') if song_data else None
+    })
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    start_trace()
+
+
+@app.after_request
+def observe_request(response):
+    """Record the request duration under its route pattern (unmatched paths share one label)"""
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route=route, status=response.status_code)
+    response.headers.update(server_timing_headers())
+    return response
+
+
+@app.teardown_request
+def clear_trace(exc):
+    end_trace()
 
 
 @app.route('/')
@@ -165,80 +1087,45 @@ def now_playing():
     """Main endpoint that returns SVG widget - now with KuGouMusicApi integration!"""
     try:
         # Get query parameters
-        user_id = request.args.get('user_id')
-        theme = request.args.get('theme', 'light')
-        width = int(request.args.get('width', 400))
-        height = int(request.args.get('height', 120))
-        show_album = request.args.get('show_album', 'true').lower() != 'false'
+        user_id, theme, width, height, show_album = parse_widget_params(request.args)
+        debug = trace_requested(request.args, request.headers)
         
-        song_data = None
+        # Demo mode - time-bucketed rotation, pre-rendered at build time when available
+        if user_id == 'demo' or not user_id:
+            return demo_response(theme, width, height, show_album)
         
-        # PRIORITY 1: Try KuGouMusicApi for real-time data (non-demo users only)
-        if user_id and user_id != 'demo':
-            song_data = get_song_from_kugou_api(user_id)
-            if song_data:
-                print(f"✅ Using real-time KuGouMusicApi data")
+        song_data, _ = resolve_song(user_id, deadline=Deadline())
         
-        # PRIORITY 2: Try to get cached song from Firebase
-        if not song_data and firebase_initialized and user_id:
-            try:
-                ref = db.reference(f'users/{user_id}/current_song')
-                song_data = ref.get()
-                if song_data:
-                    print(f"Using cached Firebase data for {user_id}")
-            except Exception as e:
-                print(f"Firebase lookup failed: {e}")
-        
-        # PRIORITY 3: Demo mode or fallback
-        if not song_data:
-            if user_id == 'demo' or not user_id:
-                # Demo mode - cycle through demo songs
-                global current_song_index
-                song_data = DEMO_SONGS[current_song_index % len(DEMO_SONGS)]
-                current_song_index = (current_song_index + 1) % len(DEMO_SONGS)
-                print("Using demo song data")
-            else:
-                # Try old KugouClient method (fallback)
-                if firebase_initialized:
-                    try:
-                        ref = db.reference(f'users/{user_id}')
-                        user_data = ref.get()
-                        if user_data and user_data.get('userid') and user_data.get('token'):
-                            print("Trying legacy KugouClient...")
-                            client = KugouClient(
-                                userid=user_data.get('userid'),
-                                token=user_data.get('token'),
-                                dfid=user_data.get('dfid'),
-                                mid=user_data.get('mid'),
-                                uuid=user_data.get('uuid')
-                            )
-                            song_data = client.get_user_listening_history()
-                    except Exception as e:
-                        print(f"Legacy Kugou API call failed: {e}")
-                
-                # Final fallback to demo
-                if not song_data:
-                    song_data = DEMO_SONGS[0]
-                    print("Using fallback demo song")
+        headers = {
+            'Cache-Control': 'public, max-age=60',
+            'Access-Control-Allow-Origin': '*'
+        }
         
         # Generate SVG with song data
+        etag = None
         if song_data:
-            svg = generate_music_svg(
-                song_name=song_data.get('name', song_data.get('song_name', 'Unknown')),
-                artist_name=song_data.get('artist', song_data.get('author_name', 'Unknown')),
-                album_cover_url=song_data.get('cover', song_data.get('img', '')),
-                theme=theme,
-                width=width,
-                height=height,
-                show_album=show_album
-            )
+            # Rendered when the song was written - no template work on read
+            pushed = pushed_widget(user_id, song_data, theme, width, height, show_album)
+            etag = pushed[0] if pushed else widget_etag(song_data, theme, width, height, show_album)
+            trace_step('widget', source='pushed' if pushed else 'render')
+            
+            # Client already has this rendering - skip SVG generation entirely
+            matched = None if debug else matched_etag(request.if_none_match, etag)
+            if matched:
+                return svg_not_modified(headers, matched)
+            
+            svg = pushed[1] if pushed else render_song_svg(song_data, theme, width, height, show_album)
         else:
-            svg = generate_default_svg(theme, width, height)
+            svg = default_svg(theme, width, height)
         
-        return Response(svg, mimetype='image/svg+xml', headers={
-            'Cache-Control': 'public, max-age=60',
-            'Access-Control-Allow-Origin': '*'
-        })
+        if debug:
+            # Decision path instead of the widget, never cached
+            response = jsonify(trace_report(user_id, song_data, etag))
+            response.headers['Cache-Control'] = 'no-store'
+            response.headers['Access-Control-Allow-Origin'] = '*'
+            return response
+        
+        return svg_response(svg, headers, etag)
         
     except Exception as e:
         print(f"Error in now_playing: {e}")
@@ -252,29 +1139,182 @@ def now_playing():
         except:
             width, height, theme = 400, 120, 'light'
         
-        svg = generate_error_svg("Service temporarily unavailable", theme, width, height)
-        return Response(svg, mimetype='image/svg+xml', headers={
+        return svg_response(error_svg(theme, width, height), {
             'Cache-Control': 'public, max-age=30',
             'Access-Control-Allow-Origin': '*'
         })
 
 
+@app.route('/now-playing')
+def now_playing_json():
+    """
+    Resolved song as JSON - the render-free path for sync tooling and other consumers
+    GET /now-playing?user_id=alice
+    """
+    try:
+        user_id = request.args.get('user_id')
+        if not user_id:
+            return jsonify({"error": "Missing required parameter: user_id"}), 400
+        
+        if user_id == 'demo':
+            RESPONSES.inc(tier='demo')
+            song_data, tier = DEMO_SONGS[demo_song_index()], 'demo'
+        else:
+            song_data, tier = resolve_song(user_id, deadline=Deadline())
+        record, etag = now_playing_record(user_id, song_data, tier)
+        
+        headers = {
+            'Cache-Control': 'public, max-age=60',
+            'Access-Control-Allow-Origin': '*',
+            'ETag': f'W/"{etag}"'
+        }
+        if etag_matches(request.if_none_match, etag):
+            return Response(status=304, headers=headers)
+        
+        response = jsonify(record)
+        response.headers.update(headers)
+        return response
+        
+    except Exception as e:
+        print(f"Error in now_playing_json: {e}")
+        print(traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/events')
+def song_events_stream():
+    """
+    Server-Sent Events: one `song` event per change of a user's current song
+    GET /events?user_id=alice (an EventSource resumes with Last-Event-ID)
+    Each open stream holds a worker thread here; serve many subscribers from asgi.py.
+    """
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Missing required parameter: user_id"}), 400
+    
+    stream = song_event_stream(user_id, request.headers.get('Last-Event-ID'))
+    return Response(stream, mimetype='text/event-stream', headers=SSE_HEADERS)
+
+
+@app.route('/batch')
+def batch_now_playing():
+    """
+    Now-playing for many users in one request
+    GET /batch?user_ids=alice,bob&format=json|svg plus the widget parameters.
+    json maps each user_id to its song; svg stacks the widgets into one sprite.
+    """
+    try:
+        _, theme, width, height, show_album = parse_widget_params(request.args)
+        output = request.args.get('format', 'json')
+        user_ids = list(dict.fromkeys(
+            user_id.strip() for user_id in request.args.get('user_ids', '').split(',') if user_id.strip()
+        ))
+        
+        if not user_ids:
+            return jsonify({"error": "Missing required parameter: user_ids"}), 400
+        if len(user_ids) > BATCH_MAX_USERS:
+            return jsonify({"error": f"At most {BATCH_MAX_USERS} user_ids per request"}), 400
+        if output not in ('json', 'svg'):
+            return jsonify({"error": "format must be json or svg"}), 400
+        
+        real_users = [user_id for user_id in user_ids if user_id != 'demo']
+        resolutions = resolve_songs(real_users, Deadline()) if real_users else {}
+        songs = {user_id: song for user_id, (song, _) in resolutions.items()}
+        
+        # user_id -> (etag, svg), svg None until rendered
+        widgets = {}
+        for user_id in user_ids:
+            if user_id == 'demo':
+                RESPONSES.inc(tier='demo')
+                svg, demo_etag = demo_widget(theme, width, height, show_album)
+                widgets[user_id] = (demo_etag, svg)
+            else:
+                widgets[user_id] = pushed_widget(user_id, songs[user_id], theme, width, height, show_album) or (
+                    widget_etag(songs[user_id], theme, width, height, show_album), None
+                )
+        etags = {user_id: widget[0] for user_id, widget in widgets.items()}
+        etag = hashlib.sha1(f"{output}:{sorted(etags.items())}".encode('utf-8')).hexdigest()
+        
+        headers = {
+            'Cache-Control': 'public, max-age=60',
+            'Access-Control-Allow-Origin': '*'
+        }
+        matched = matched_etag(request.if_none_match, etag)
+        if matched and output == 'svg':
+            return svg_not_modified(headers, matched)
+        if matched:
+            headers['ETag'] = f'"{etag}"'
+            return Response(status=304, headers=headers)
+        
+        if output == 'svg':
+            bodies = []
+            for user_id in user_ids:
+                svg = widgets[user_id][1] or render_song_svg(songs[user_id], theme, width, height, show_album)
+                bodies.append((user_id, svg.body))
+            return svg_response(sprite_svg(bodies, width, height), headers, etag)
+        
+        users = {}
+        for user_id in user_ids:
+            song = songs[user_id] if user_id != 'demo' else DEMO_SONGS[demo_song_index()]
+            name, artist, cover = _song_fields(song)
+            users[user_id] = {
+                "name": name,
+                "artist": artist,
+                "cover": cover,
+                "source": song.get('source'),
+                "updated_at": song.get('updated_at'),
+                "etag": etags[user_id]
+            }
+        response = jsonify({"users": users})
+        response.headers.update(headers)
+        response.headers['ETag'] = f'"{etag}"'
+        return response
+        
+    except Exception as e:
+        print(f"Error in batch: {e}")
+        print(traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/health')
 def health_check():
     """Health check endpoint"""
     return jsonify({
         "status": "healthy",
-        "firebase_connected": firebase_initialized,
+        "firebase_connected": storage.name == "firebase" and storage.available(),
+        "storage": storage.name,
         "version": "1.0.0"
     })
 
 
+@app.route('/cache-stats')
+def cache_stats():
+    """Hit/miss/eviction counters for the in-process caches"""
+    return jsonify({
+        "svg": svg_cache.stats(),
+        "credentials": kugou_creds_cache.stats(),
+        "current_song": last_song_cache.stats(),
+        "recent_song": recent_song_cache.stats(),
+        "covers": cover_cache_stats(),
+        "pushed_widgets": pushed_widgets.stats(),
+        "upstream_singleflight": upstream_flight.stats(),
+        "upstream_circuits": upstream_breaker.stats(),
+        "song_events": song_events.stats()
+    })
+
+
+@app.route('/metrics')
+def metrics():
+    """Request, stage and upstream metrics in the Prometheus text format (this instance only)"""
+    return Response(render_prometheus(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
 @app.route('/update', methods=['POST'])
 def update_now_playing():
     """Manually update current song"""
     try:
-        if not firebase_initialized:
-            return jsonify({"error": "Firebase not configured"}), 500
+        if not storage.available():
+            return jsonify({"error": "Storage not configured"}), 500
         
         data = request.get_json()
         user_id = data.get('user_id')
@@ -285,14 +1325,8 @@ def update_now_playing():
         if not all([user_id, song_name, artist_name]):
             return jsonify({"error": "Missing required fields: user_id, song_name, artist_name"}), 400
         
-        # Update current song in Firebase
-        ref = db.reference(f'users/{user_id}/current_song')
-        ref.set({
-            'name': song_name,
-            'artist': artist_name,
-            'cover': cover_url,
-            'updated_at': int(time.time())
-        })
+        # Update current song in storage
+        save_current_song(user_id, song_name, artist_name, cover_url)
         
         return jsonify({
             "success": True,
@@ -318,8 +1352,8 @@ def setup_kugou():
     }
     """
     try:
-        if not firebase_initialized:
-            return jsonify({"error": "Firebase not configured"}), 500
+        if not storage.available():
+            return jsonify({"error": "Storage not configured"}), 500
         
         data = request.get_json()
         user_id = data.get('user_id')
@@ -333,7 +1367,7 @@ def setup_kugou():
                 "required": ["user_id", "api_url", "userid", "token"]
             }), 400
         
-        # Save credentials to Firebase
+        # Save credentials to storage
         creds = {
             'api_url': api_url,
             'userid': userid,
@@ -341,8 +1375,8 @@ def setup_kugou():
             'setup_at': int(time.time())
         }
         
-        ref = db.reference(f'users/{user_id}/kugou_credentials')
-        ref.set(creds)
+        storage.set_credentials(user_id, creds)
+        invalidate_kugou_credentials(user_id)
         
         return jsonify({
             "success": True,
@@ -399,8 +1433,8 @@ def login_guide():
 def refresh_tokens():
     """Refresh expired Kugou tokens"""
     try:
-        if not firebase_initialized:
-            return jsonify({"error": "Firebase not configured"}), 500
+        if not storage.available():
+            return jsonify({"error": "Storage not configured"}), 500
         
         data = request.get_json()
         user_id = data.get('user_id')
@@ -409,8 +1443,7 @@ def refresh_tokens():
             return jsonify({"error": "Missing user_id"}), 400
         
         # Get existing user data
-        ref = db.reference(f'users/{user_id}')
-        user_data = ref.get()
+        user_data = storage.get_user(user_id)
         
         if not user_data:
             return jsonify({"error": "User not found"}), 404
@@ -427,6 +1460,7 @@ def refresh_tokens():
             })
         
         # Attempt token refresh (this would need actual Kugou refresh endpoint)
+        from kugou_client import KugouClient
         client = KugouClient(
             userid=user_data.get('userid'),
             token=user_data.get('token'),
@@ -439,10 +1473,11 @@ def refresh_tokens():
         # For now, just extend the expiration
         new_expires_at = current_time + (7 * 24 * 60 * 60 * 1000)  # 7 days
         
-        ref.update({
+        storage.update_user(user_id, {
             'expires_at': new_expires_at,
             'last_refresh': current_time
         })
+        invalidate_kugou_credentials(user_id)
         
         return jsonify({
             "success": True,
@@ -459,45 +1494,7 @@ def refresh_tokens():
 def get_user_info(user_id):
     """Get user configuration and current song info"""
     try:
-        if not firebase_initialized:
-            return jsonify({
-                "user_id": user_id,
-                "mode": "demo" if user_id == "demo" else "no_firebase",
-                "firebase_connected": False
-            })
-        
-        ref = db.reference(f'users/{user_id}')
-        user_data = ref.get()
-        
-        if not user_data:
-            return jsonify({
-                "user_id": user_id,
-                "mode": "not_configured",
-                "message": "User not found in database"
-            })
-        
-        # Check token expiration
-        expires_at = user_data.get('expires_at', 0)
-        current_time = int(time.time() * 1000)
-        is_expired = current_time >= expires_at
-        
-        # Get current song
-        current_song = None
-        song_ref = db.reference(f'users/{user_id}/current_song')
-        current_song = song_ref.get()
-        
-        response = {
-            "user_id": user_id,
-            "mode": "configured",
-            "has_credentials": bool(user_data.get('userid') and user_data.get('token')),
-            "token_expired": is_expired,
-            "expires_at": expires_at,
-            "current_time": current_time,
-            "current_song": current_song,
-            "last_updated": current_song.get('updated_at') if current_song else None
-        }
-        
-        return jsonify(response)
+        return jsonify(build_user_info(user_id))
         
     except Exception as e:
         print(f"Error in get_user_info: {e}")
@@ -4,16 +4,32 @@ Handles communication with Kugou music service API with proper encryption and si
 """
 import requests
 import hashlib
-import base64
-import json
 import time
+import threading
 import uuid as uuid_lib
-from Crypto.Cipher import AES
-from Crypto.PublicKey import RSA
-from Crypto.Cipher import PKCS1_v1_5
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
 from typing import Optional, Dict, Any
 
 
+# Candidate listening-history endpoints (best guesses based on API patterns)
+LISTENING_ENDPOINTS = [
+    "/api/v3/user/listen",
+    "/api/v5/user/listen",
+    "/api/v3/user/recent",
+    "/api/v5/user/recent"
+]
+
+# Seconds before a remembered working endpoint is re-probed against the others
+ENDPOINT_REPROBE_SECONDS = 600
+
+# Per-process memo of the endpoint that last worked, keyed by API host
+_endpoint_memo = {}
+_endpoint_memo_lock = threading.Lock()
+
+# Shared pool for racing endpoint attempts
+_race_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="kugou-endpoint")
+
+
 class KugouClient:
     """Client for interacting with Kugou music API with proper authentication"""
     
@@ -83,44 +99,85 @@ class KugouClient:
             'uuid': self.uuid
         }
     
-    def get_user_listening_history(self) -> Optional[Dict[str, Any]]:
+    def _fetch_listening_endpoint(self, endpoint: str, timeout: float = 10) -> Optional[Dict[str, Any]]:
+        """Query one candidate listening-history endpoint, returning None on any failure"""
+        try:
+            params = self._get_common_params()
+            params.update({
+                'page': 1,
+                'pagesize': 1
+            })
+            
+            # Generate signature
+            params['signature'] = self._generate_signature(params.copy())
+            
+            response = self.session.get(f"{self.mobile_url}{endpoint}", params=params, timeout=timeout)
+            
+            if response.status_code == 200:
+                data = response.json()
+                if data.get("status") == 1 and data.get("data"):
+                    return data["data"][0] if isinstance(data["data"], list) else data["data"]
+            
+        except Exception as e:
+            print(f"Failed endpoint {endpoint}: {e}")
+        
+        return None
+    
+    def _remembered_endpoint(self) -> Optional[str]:
+        """Endpoint that last worked for this host, unless it is due for a re-probe"""
+        with _endpoint_memo_lock:
+            memo = _endpoint_memo.get(self.mobile_url)
+        if memo and time.time() - memo[1] < ENDPOINT_REPROBE_SECONDS:
+            return memo[0]
+        return None
+    
+    def _remember_endpoint(self, endpoint: Optional[str]) -> None:
+        """Record (or forget, with None) the working endpoint for this host"""
+        with _endpoint_memo_lock:
+            if endpoint:
+                _endpoint_memo[self.mobile_url] = (endpoint, time.time())
+            else:
+                _endpoint_memo.pop(self.mobile_url, None)
+    
+    def get_user_listening_history(self, timeout: float = 10) -> Optional[Dict[str, Any]]:
         """
         Attempt to get listening history
         NOTE: This endpoint may not exist - using best guess based on patterns
+        The endpoint that last worked is tried alone; otherwise all candidates
+        are raced concurrently and the first valid response wins. timeout
+        bounds the whole lookup, not each attempt.
         """
         if not self.userid or not self.token:
             return None
-            
+        
+        expires_at = time.monotonic() + timeout
         try:
-            # Try multiple possible endpoints
-            endpoints_to_try = [
-                "/api/v3/user/listen",
-                "/api/v5/user/listen", 
-                "/api/v3/user/recent",
-                "/api/v5/user/recent"
-            ]
+            endpoint = self._remembered_endpoint()
+            if endpoint:
+                result = self._fetch_listening_endpoint(endpoint, timeout)
+                if result:
+                    return result
+                self._remember_endpoint(None)
             
-            for endpoint in endpoints_to_try:
-                try:
-                    params = self._get_common_params()
-                    params.update({
-                        'page': 1,
-                        'pagesize': 1
-                    })
-                    
-                    # Generate signature
-                    params['signature'] = self._generate_signature(params.copy())
-                    
-                    response = self.session.get(f"{self.mobile_url}{endpoint}", params=params, timeout=10)
-                    
-                    if response.status_code == 200:
-                        data = response.json()
-                        if data.get("status") == 1 and data.get("data"):
-                            return data["data"][0] if isinstance(data["data"], list) else data["data"]
-                    
-                except Exception as e:
-                    print(f"Failed endpoint {endpoint}: {e}")
-                    continue
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                return None
+            futures = {
+                _race_executor.submit(self._fetch_listening_endpoint, endpoint, remaining): endpoint
+                for endpoint in LISTENING_ENDPOINTS
+            }
+            try:
+                for future in as_completed(futures, timeout=remaining):
+                    result = future.result()
+                    if result:
+                        self._remember_endpoint(futures[future])
+                        return result
+            except FuturesTimeoutError:
+                print("Listening history lookup ran out of time")
+            finally:
+                # Losing attempts finish (or time out) in the background
+                for future in futures:
+                    future.cancel()
                     
             return None
             
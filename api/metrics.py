@@ -0,0 +1,220 @@
+"""
+Request metrics
+Thread-safe counters and histograms rendered in the Prometheus text format by
+the /metrics route. Values are per process (one warm serverless instance).
+The same stage timings also feed a per-request Trace, sent back as a
+Server-Timing header and, on request, as a JSON breakdown.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Seconds; spans cache hits (sub-ms) to upstream timeouts
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Per-request stage breakdown in a Server-Timing response header
+SERVER_TIMING = os.getenv("SERVER_TIMING", "true").lower() != "false"
+
+_registry = []
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Bucketed distribution of observed values with optional labels"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last is +Inf), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count)
+                            in self._series.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % ("+Inf" if bound == float("inf") else repr(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {repr(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+def render_prometheus() -> str:
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+REQUEST_SECONDS = Histogram(
+    "widget_request_seconds", "Time to handle a request, by route", ["route", "status"]
+)
+STAGE_SECONDS = Histogram(
+    "widget_stage_seconds", "Time spent in one stage of serving a widget", ["stage"]
+)
+RESPONSES = Counter(
+    "widget_responses_total", "Widget responses by the priority tier that supplied the song", ["tier"]
+)
+UPSTREAM_CALLS = Counter(
+    "widget_upstream_calls_total", "KuGouMusicApi recentListening calls by outcome", ["outcome"]
+)
+
+
+class Trace:
+    """Stage timings and priority-chain decisions of one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        # (stage, start offset, seconds) in completion order
+        self.spans = []
+        # {"step": name, ...details} in decision order
+        self.steps = []
+        # Blocking stages may run in worker threads (asyncio.to_thread)
+        self._lock = threading.Lock()
+
+    def add_span(self, stage: str, start: float, seconds: float) -> None:
+        with self._lock:
+            self.spans.append((stage, start - self.started, seconds))
+
+    def step(self, name: str, **detail) -> None:
+        with self._lock:
+            self.steps.append(dict(detail, step=name))
+
+    def server_timing(self) -> str:
+        """Server-Timing header value: total per stage (repeats summed) plus the request total"""
+        totals = {}
+        with self._lock:
+            for stage, _, seconds in self.spans:
+                totals[stage] = totals.get(stage, 0.0) + seconds
+        entries = ["%s;dur=%.1f" % (stage.replace("_", "-"), seconds * 1000) for stage, seconds in totals.items()]
+        entries.append("total;dur=%.1f" % ((time.perf_counter() - self.started) * 1000))
+        return ", ".join(entries)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "steps": list(self.steps),
+                "stages": [
+                    {"stage": stage, "start_ms": round(offset * 1000, 2), "duration_ms": round(seconds * 1000, 2)}
+                    for stage, offset, seconds in self.spans
+                ],
+                "total_ms": round((time.perf_counter() - self.started) * 1000, 2)
+            }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+def start_trace() -> Trace:
+    """Begin tracing the current request (thread or task)"""
+    trace = Trace()
+    _current_trace.set(trace)
+    return trace
+
+
+def end_trace() -> None:
+    _current_trace.set(None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def trace_step(name: str, **detail) -> None:
+    """Record a decision in the current request's trace, if any"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.step(name, **detail)
+
+
+def server_timing_headers() -> Dict[str, str]:
+    """Server-Timing for the current request; Timing-Allow-Origin lets cross-origin embeds see it"""
+    trace = _current_trace.get()
+    if not SERVER_TIMING or trace is None:
+        return {}
+    return {"Server-Timing": trace.server_timing(), "Timing-Allow-Origin": "*"}
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """
+    Observe the duration of the with-block as widget_stage_seconds{stage=...}
+    and add it to the current request's trace
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_span(stage, start, seconds)
+
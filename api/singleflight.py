@@ -0,0 +1,127 @@
+"""
+Single-flight request coalescing
+Concurrent callers asking for the same key share one in-flight execution
+"""
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class _Call:
+    """One in-flight execution and the waiters sharing its outcome"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Run fn once per key at a time; duplicates wait for and share the result"""
+
+    def __init__(self, name: str = "singleflight"):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+        self.executions = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Call fn(*args, **kwargs), or join an identical call already in flight"""
+        return self.do_within(None, key, fn, *args, **kwargs)
+
+    def do_within(self, timeout: Optional[float], key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        do(), except that a caller joining an in-flight call raises TimeoutError
+        after timeout seconds (None waits forever); the call itself carries on
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self.executions += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            if not call.done.wait(timeout):
+                with self._lock:
+                    self.timeouts += 1
+                raise TimeoutError(f"{self.name}: in-flight call for {key!r} outlived the wait")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """Execution vs coalesced counts"""
+        with self._lock:
+            return {
+                "name": self.name,
+                "in_flight": len(self._calls),
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "timeouts": self.timeouts
+            }
+
+
+class AsyncSingleFlight:
+    """asyncio counterpart of SingleFlight for coroutine functions"""
+
+    def __init__(self, name: str = "singleflight"):
+        self.name = name
+        self._calls = {}
+
+        self.executions = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """Await fn(*args, **kwargs), or join an identical call already in flight"""
+        return await self.do_within(None, key, fn, *args, **kwargs)
+
+    async def do_within(self, timeout: Optional[float], key: Hashable,
+                        fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """SingleFlight.do_within for coroutine functions"""
+        # Imported here so the sync (Flask) entry point doesn't load asyncio at cold start
+        import asyncio
+
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # shield() so a cancelled (or timed out) waiter doesn't cancel the shared call
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise TimeoutError(f"{self.name}: in-flight call for {key!r} outlived the wait")
+
+        self.executions += 1
+        future = asyncio.ensure_future(fn(*args, **kwargs))
+        self._calls[key] = future
+        future.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(future)
+
+    def stats(self) -> Dict[str, Any]:
+        """Execution vs coalesced counts"""
+        return {
+            "name": self.name,
+            "in_flight": len(self._calls),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "timeouts": self.timeouts
+        }
@@ -0,0 +1,131 @@
+"""
+Song change events
+Fans out current-song changes to per-user subscribers (the /events
+Server-Sent Events streams). Publishers are the song write paths and a
+storage watcher; a subscriber is just a callback, so an idle stream costs a
+dict entry until its user's song changes.
+"""
+import json
+import os
+import queue
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+# Comment frame sent on idle streams so proxies don't close them
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", 15))
+
+# Streams end after this long; EventSource reconnects after SSE_RETRY_MS
+SSE_MAX_SECONDS = float(os.getenv("SSE_MAX_SECONDS", 600))
+SSE_RETRY_MS = int(os.getenv("SSE_RETRY_MS", 3000))
+
+# How often storage is re-read for users with subscribers, catching songs
+# written by other instances or the sync daemon
+SSE_POLL_SECONDS = float(os.getenv("SSE_POLL_SECONDS", 10))
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'Access-Control-Allow-Origin': '*',
+    # Stop nginx-style proxies from buffering the stream
+    'X-Accel-Buffering': 'no'
+}
+
+
+class SongEvents:
+    """Per-user subscriber callbacks and the last event each user's subscribers saw"""
+
+    def __init__(self):
+        self._listeners = {}
+        # user_id -> (song key, event); only kept while the user has subscribers
+        self._latest = {}
+        self._lock = threading.Lock()
+
+        self.published = 0
+        self.deliveries = 0
+
+    def subscribe(self, user_id: str, listener: Callable[[Dict[str, Any]], None]) -> Callable[[], None]:
+        """Call listener(event) on each change of user_id's song; returns the unsubscribe function"""
+        with self._lock:
+            self._listeners.setdefault(user_id, []).append(listener)
+
+        def unsubscribe():
+            with self._lock:
+                listeners = self._listeners.get(user_id, [])
+                if listener in listeners:
+                    listeners.remove(listener)
+                if not listeners:
+                    self._listeners.pop(user_id, None)
+                    self._latest.pop(user_id, None)
+
+        return unsubscribe
+
+    def seed(self, user_id: str, key: Hashable, event: Dict[str, Any]) -> Dict[str, Any]:
+        """Set the starting event for a subscribed user unless one is known; returns the current one"""
+        with self._lock:
+            if user_id not in self._listeners:
+                return event
+            return self._latest.setdefault(user_id, (key, event))[1]
+
+    def has_subscribers(self, user_id: str) -> bool:
+        with self._lock:
+            return user_id in self._listeners
+
+    def latest(self, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._latest.get(user_id)
+            return entry[1] if entry else None
+
+    def publish(self, user_id: str, key: Hashable, event: Dict[str, Any]) -> bool:
+        """Deliver event to user_id's subscribers if the song (key) changed; False if not delivered"""
+        with self._lock:
+            listeners = list(self._listeners.get(user_id, ()))
+            if not listeners:
+                return False
+            entry = self._latest.get(user_id)
+            if entry and entry[0] == key:
+                return False
+            self._latest[user_id] = (key, event)
+            self.published += 1
+            self.deliveries += len(listeners)
+
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                print(f"Song event delivery failed for {user_id}: {e}")
+        return True
+
+    def watched(self) -> List[str]:
+        """Users that currently have subscribers"""
+        with self._lock:
+            return list(self._listeners)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "users": len(self._listeners),
+                "subscribers": sum(len(listeners) for listeners in self._listeners.values()),
+                "published": self.published,
+                "deliveries": self.deliveries
+            }
+
+
+def sse_frame(event: Dict[str, Any]) -> str:
+    """One `song` event in the text/event-stream format"""
+    return f"id: {event['id']}\nevent: song\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+
+def offer(updates: "queue.Queue", event: Dict[str, Any]) -> None:
+    """Put event in a subscriber's one-slot queue, replacing an unread older one"""
+    try:
+        updates.get_nowait()
+    except queue.Empty:
+        pass
+    try:
+        updates.put_nowait(event)
+    except queue.Full:
+        # A concurrent publish got there first
+        pass
+
+
+SSE_RETRY_FRAME = f"retry: {SSE_RETRY_MS}\n\n"
+SSE_HEARTBEAT_FRAME = ": keep-alive\n\n"
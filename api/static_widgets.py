@@ -0,0 +1,108 @@
+"""
+Static widget variants
+Demo, default and error widgets depend only on theme and size, so build_static.py
+pre-renders them into files Vercel serves from the edge. This module holds the
+demo data, the variant naming shared with the build, and the runtime lookup.
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from svg_output import EncodedSVG
+
+# Demo song data for immediate testing
+DEMO_SONGS = [
+    {
+        'name': '告白气球',
+        'artist': '周杰伦',
+        'cover': 'https://imge.kugou.com/stdmusic/240/20170418/20170418173403349763.jpg'
+    },
+    {
+        'name': '青花瓷',
+        'artist': '周杰伦',
+        'cover': 'https://imge.kugou.com/stdmusic/240/20160818/20160818112845056710.jpg'
+    },
+    {
+        'name': '稻香',
+        'artist': '周杰伦',
+        'cover': 'https://imge.kugou.com/stdmusic/240/20150719/20150719205742894772.jpg'
+    }
+]
+
+# Demo songs rotate on fixed wall-clock buckets, so every instance (and the
+# edge cache) agrees on the current song instead of cycling per request
+DEMO_ROTATE_SECONDS = int(os.getenv("DEMO_ROTATE_SECONDS", 600))
+
+SERVICE_ERROR_MESSAGE = "Service temporarily unavailable"
+
+THEMES = ("light", "dark")
+DEFAULT_SIZES = ((400, 120),)
+
+STATIC_WIDGETS_DIR = os.getenv(
+    "STATIC_WIDGETS_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "public", "widgets")
+)
+MANIFEST_NAME = "manifest.json"
+
+_manifest = None
+_loaded = {}
+_lock = threading.Lock()
+
+
+def demo_song_index(now: Optional[float] = None) -> int:
+    """Index into DEMO_SONGS for the current rotation bucket"""
+    now = time.time() if now is None else now
+    return int(now // DEMO_ROTATE_SECONDS) % len(DEMO_SONGS)
+
+
+def demo_seconds_remaining(now: Optional[float] = None) -> int:
+    """Seconds until the demo rotates - how long a demo response may be cached"""
+    now = time.time() if now is None else now
+    return max(1, int(DEMO_ROTATE_SECONDS - now % DEMO_ROTATE_SECONDS))
+
+
+def variant_path(kind: str, theme: str, width: int, height: int,
+                 show_album: bool = True, demo_index: Optional[int] = None) -> str:
+    """Path of a pre-rendered variant relative to STATIC_WIDGETS_DIR"""
+    theme = "dark" if theme == "dark" else "light"
+    name = f"{theme}-{width}x{height}"
+    if kind == "demo":
+        if not show_album:
+            name += "-noalbum"
+        return f"demo/{demo_index}/{name}.svg"
+    return f"{kind}/{name}.svg"
+
+
+def _load_manifest() -> Dict[str, str]:
+    """variant path -> ETag for everything the build produced ({} if not built)"""
+    global _manifest
+    if _manifest is None:
+        try:
+            with open(os.path.join(STATIC_WIDGETS_DIR, MANIFEST_NAME), encoding="utf-8") as f:
+                _manifest = json.load(f).get("variants", {})
+        except (OSError, ValueError):
+            _manifest = {}
+    return _manifest
+
+
+def load_variant(path: str) -> Optional[Tuple[EncodedSVG, str]]:
+    """(svg body, etag) of a pre-rendered variant, or None if it wasn't built"""
+    etag = _load_manifest().get(path)
+    if etag is None:
+        return None
+
+    with _lock:
+        if path in _loaded:
+            return _loaded[path]
+
+    try:
+        with open(os.path.join(STATIC_WIDGETS_DIR, path), "rb") as f:
+            variant = (EncodedSVG(f.read()), etag)
+    except OSError:
+        variant = None
+
+    with _lock:
+        _loaded[path] = variant
+    return variant
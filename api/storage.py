@@ -0,0 +1,307 @@
+"""
+Storage backends
+Persistence for per-user config, Kugou credentials and the current song.
+Firebase Realtime Database is the default; the in-memory and SQLite backends
+serve self-hosted deployments and benchmarks without network round trips.
+Select one with STORAGE_BACKEND=firebase|memory|sqlite.
+
+Every backend stores a user as the shape of the Firebase users/{user_id} node:
+config fields at the top level plus "kugou_credentials" and "current_song".
+"""
+import copy
+import json
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firebase").lower()
+STORAGE_SQLITE_PATH = os.getenv("STORAGE_SQLITE_PATH", "kugou-widget.db")
+
+# Per-call HTTP timeout of the Firebase Admin SDK (its default is 120s). Requests
+# stop waiting at their deadline regardless; this frees the worker behind them.
+FIREBASE_HTTP_TIMEOUT = float(os.getenv("FIREBASE_HTTP_TIMEOUT", 10))
+
+CREDENTIALS = "kugou_credentials"
+CURRENT_SONG = "current_song"
+
+
+class StorageBackend:
+    """Interface shared by all backends; user nodes are plain dicts"""
+
+    name = "base"
+
+    def available(self) -> bool:
+        """Whether the backend is configured and usable"""
+        return True
+
+    def get_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """The whole user node, or None if the user doesn't exist"""
+        raise NotImplementedError
+
+    def get_users(self, user_ids: Iterable[str], executor=None) -> Dict[str, Dict[str, Any]]:
+        """
+        User nodes for many users at once; users that don't exist map to {}.
+        Backends without a bulk read fetch one node per user, concurrently on
+        executor (a concurrent.futures executor) when given.
+        """
+        user_ids = list(user_ids)
+        nodes = executor.map(self.get_user, user_ids) if executor else map(self.get_user, user_ids)
+        return {user_id: node or {} for user_id, node in zip(user_ids, nodes)}
+
+    def list_users(self) -> List[str]:
+        """Ids of all stored users"""
+        raise NotImplementedError
+
+    def update_user(self, user_id: str, fields: Dict[str, Any]) -> None:
+        """Merge top-level config fields into the user node"""
+        raise NotImplementedError
+
+    def get_credentials(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return (self.get_user(user_id) or {}).get(CREDENTIALS)
+
+    def set_credentials(self, user_id: str, credentials: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def get_current_song(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return (self.get_user(user_id) or {}).get(CURRENT_SONG)
+
+    def set_current_song(self, user_id: str, song: Dict[str, Any]) -> None:
+        """Replace the current song record"""
+        raise NotImplementedError
+
+    def update_current_song(self, user_id: str, fields: Dict[str, Any]) -> None:
+        """Merge fields (updated_at heartbeat, rendered widgets) into the current song"""
+        raise NotImplementedError
+
+
+class FirebaseStorage(StorageBackend):
+    """
+    Firebase Realtime Database. The Admin SDK is imported and initialized on
+    first access, so cold starts that never touch storage don't pay for it.
+    Batch reads are concurrent per-user gets: the SDK has no multi-path get, and
+    a key-range query would download every user between the requested ids.
+    """
+
+    name = "firebase"
+
+    def __init__(self, database=None):
+        # database: an initialized firebase_admin.db (or a stand-in with its reference API)
+        self._db = database
+        self._failed = False
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        if self._db is not None:
+            return True
+        return bool(os.getenv("FIREBASE_CREDENTIALS")) and not self._failed
+
+    def _database(self):
+        if self._db is None:
+            with self._lock:
+                if self._db is None:
+                    try:
+                        import firebase_admin
+                        from firebase_admin import credentials, db
+                        cred = credentials.Certificate(json.loads(os.getenv("FIREBASE_CREDENTIALS")))
+                        firebase_admin.initialize_app(cred, {
+                            'databaseURL': os.getenv("FIREBASE_DATABASE_URL"),
+                            'httpTimeout': FIREBASE_HTTP_TIMEOUT
+                        })
+                    except Exception as e:
+                        print(f"Firebase initialization failed: {e}")
+                        self._failed = True
+                        raise
+                    self._db = db
+                    print("Firebase initialized successfully")
+        return self._db
+
+    def _ref(self, path: str):
+        return self._database().reference(path)
+
+    def get_user(self, user_id):
+        return self._ref(f'users/{user_id}').get()
+
+    def list_users(self):
+        # Shallow: just the keys, not every user's node (rendered widgets included)
+        return sorted(self._ref('users').get(shallow=True) or {})
+
+    def update_user(self, user_id, fields):
+        self._ref(f'users/{user_id}').update(fields)
+
+    def get_credentials(self, user_id):
+        return self._ref(f'users/{user_id}/{CREDENTIALS}').get()
+
+    def set_credentials(self, user_id, credentials):
+        self._ref(f'users/{user_id}/{CREDENTIALS}').set(credentials)
+
+    def get_current_song(self, user_id):
+        return self._ref(f'users/{user_id}/{CURRENT_SONG}').get()
+
+    def set_current_song(self, user_id, song):
+        self._ref(f'users/{user_id}/{CURRENT_SONG}').set(song)
+
+    def update_current_song(self, user_id, fields):
+        self._ref(f'users/{user_id}/{CURRENT_SONG}').update(fields)
+
+
+class MemoryStorage(StorageBackend):
+    """Process-local dict; state is lost on restart (single-instance hosts, benchmarks)"""
+
+    name = "memory"
+
+    def __init__(self, users: Optional[Dict[str, Dict[str, Any]]] = None):
+        self._users = copy.deepcopy(users) if users else {}
+        self._lock = threading.Lock()
+
+    def get_user(self, user_id):
+        with self._lock:
+            user = self._users.get(user_id)
+            return copy.deepcopy(user) if user else None
+
+    def get_users(self, user_ids, executor=None):
+        # Dict lookups - not worth spreading over threads
+        return super().get_users(user_ids)
+
+    def list_users(self):
+        with self._lock:
+            return sorted(self._users)
+
+    def update_user(self, user_id, fields):
+        with self._lock:
+            self._users.setdefault(user_id, {}).update(copy.deepcopy(fields))
+
+    def _set_child(self, user_id, key, value):
+        with self._lock:
+            self._users.setdefault(user_id, {})[key] = copy.deepcopy(value)
+
+    def set_credentials(self, user_id, credentials):
+        self._set_child(user_id, CREDENTIALS, credentials)
+
+    def set_current_song(self, user_id, song):
+        self._set_child(user_id, CURRENT_SONG, song)
+
+    def update_current_song(self, user_id, fields):
+        with self._lock:
+            user = self._users.setdefault(user_id, {})
+            user.setdefault(CURRENT_SONG, {}).update(copy.deepcopy(fields))
+
+
+class SQLiteStorage(StorageBackend):
+    """
+    Embedded SQLite file: one row per user with config, credentials and current
+    song as JSON columns. Connections are per thread; WAL keeps reads unblocked.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = STORAGE_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            " user_id TEXT PRIMARY KEY,"
+            " config TEXT NOT NULL DEFAULT '{}',"
+            " credentials TEXT,"
+            " current_song TEXT)"
+        )
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            import sqlite3
+            connection = sqlite3.connect(self.path, isolation_level=None, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _node(config, credentials, current_song):
+        user = json.loads(config)
+        if credentials is not None:
+            user[CREDENTIALS] = json.loads(credentials)
+        if current_song is not None:
+            user[CURRENT_SONG] = json.loads(current_song)
+        return user
+
+    def get_user(self, user_id):
+        row = self._connection().execute(
+            "SELECT config, credentials, current_song FROM users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return self._node(*row) if row else None
+
+    def get_users(self, user_ids, executor=None):
+        # One IN query; executor isn't needed
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        rows = self._connection().execute(
+            "SELECT user_id, config, credentials, current_song FROM users"
+            f" WHERE user_id IN ({','.join('?' * len(user_ids))})",
+            user_ids
+        ).fetchall()
+        found = {row[0]: self._node(*row[1:]) for row in rows}
+        return {user_id: found.get(user_id, {}) for user_id in user_ids}
+
+    def list_users(self):
+        rows = self._connection().execute("SELECT user_id FROM users ORDER BY user_id").fetchall()
+        return [row[0] for row in rows]
+
+    def _get_column(self, user_id, column):
+        row = self._connection().execute(
+            f"SELECT {column} FROM users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row and row[0] is not None else None
+
+    def _merge_column(self, user_id, column, fields):
+        """Read-modify-write one JSON column inside a write transaction"""
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            current = self._get_column(user_id, column) or {}
+            current.update(fields)
+            self._set_column(user_id, column, current)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _set_column(self, user_id, column, value):
+        self._connection().execute(
+            f"INSERT INTO users (user_id, {column}) VALUES (?, ?)"
+            f" ON CONFLICT(user_id) DO UPDATE SET {column} = excluded.{column}",
+            (user_id, json.dumps(value, ensure_ascii=False))
+        )
+
+    def update_user(self, user_id, fields):
+        self._merge_column(user_id, "config", fields)
+
+    def get_credentials(self, user_id):
+        return self._get_column(user_id, "credentials")
+
+    def set_credentials(self, user_id, credentials):
+        self._set_column(user_id, "credentials", credentials)
+
+    def get_current_song(self, user_id):
+        return self._get_column(user_id, "current_song")
+
+    def set_current_song(self, user_id, song):
+        self._set_column(user_id, "current_song", song)
+
+    def update_current_song(self, user_id, fields):
+        self._merge_column(user_id, "current_song", fields)
+
+
+BACKENDS = {
+    "firebase": FirebaseStorage,
+    "memory": MemoryStorage,
+    "sqlite": SQLiteStorage,
+}
+
+
+def create_storage(name: str = STORAGE_BACKEND) -> StorageBackend:
+    """Backend instance for a STORAGE_BACKEND name"""
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown STORAGE_BACKEND {name!r}; choose from {sorted(BACKENDS)}")
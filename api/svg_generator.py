@@ -2,30 +2,35 @@
 SVG Generator
 Generates SVG widgets for displaying now playing information
 """
+from functools import lru_cache
 from typing import Optional, Dict, Any
+import base64
 import html
+import re
 
+from svg_output import MINIFY_SVG, minify_svg
 
-def generate_music_svg(
+
+# Inline album placeholder - external hrefs inside an SVG image are often not loaded
+_PLACEHOLDER_SVG = (
+    '<svg xmlns="http://www.w3.org/2000/svg" width="100" height="100">'
+    '<rect width="100" height="100" fill="#333333"/>'
+    '<text x="50" y="64" font-size="40" fill="#ffffff" text-anchor="middle">♪</text>'
+    '</svg>'
+)
+PLACEHOLDER_COVER = "data:image/svg+xml;base64," + base64.b64encode(_PLACEHOLDER_SVG.encode("utf-8")).decode("ascii")
+
+
+def _music_document(
     song_name: str,
     artist_name: str,
-    album_cover_url: str = "",
-    theme: str = "light",
-    width: int = 400,
-    height: int = 120,
-    show_album: bool = True
+    album_cover_url: str,
+    theme: str,
+    width: int,
+    height: int,
+    show_album: bool
 ) -> str:
-    """Generate SVG widget for currently playing song"""
-    
-    # Escape HTML to prevent XSS
-    song_name = html.escape(song_name or "Unknown Song")
-    artist_name = html.escape(artist_name or "Unknown Artist")
-    
-    # Truncate long names
-    if len(song_name) > 30:
-        song_name = song_name[:27] + "..."
-    if len(artist_name) > 30:
-        artist_name = artist_name[:27] + "..."
+    """Full now-playing document; fields are inserted as given (already escaped)"""
     
     # Theme colors
     if theme == "dark":
@@ -39,10 +44,6 @@ def generate_music_svg(
         secondary_color = "#666666"
         accent_color = "#1DB954"
     
-    # Default album cover if none provided
-    if not album_cover_url:
-        album_cover_url = "https://via.placeholder.com/100x100/333333/ffffff?text=♪"
-    
     # Calculate positions
     album_x = 10 if show_album else 0
     text_x = 120 if show_album else 20
@@ -90,8 +91,8 @@ def generate_music_svg(
     return svg_content
 
 
-def generate_default_svg(theme: str = "light", width: int = 400, height: int = 120) -> str:
-    """Generate default SVG when no music is playing"""
+def _default_document(theme: str, width: int, height: int) -> str:
+    """Full not-playing document"""
     
     if theme == "dark":
         bg_color = "#1a1a1a"
@@ -124,10 +125,8 @@ def generate_default_svg(theme: str = "light", width: int = 400, height: int = 1
     return svg
 
 
-def generate_error_svg(error_message: str = "Error loading widget", theme: str = "light", width: int = 400, height: int = 120) -> str:
-    """Generate SVG widget for error state"""
-    
-    error_message = html.escape(error_message)
+def _error_document(error_message: str, theme: str, width: int, height: int) -> str:
+    """Full error document; the message is inserted as given (already escaped)"""
     
     if theme == "dark":
         bg_color = "#1a1a1a"
@@ -158,6 +157,133 @@ def generate_error_svg(error_message: str = "Error loading widget", theme: str =
     return svg
 
 
+class SVGTemplate:
+    """
+    A document precompiled for one theme/size/layout combination: static
+    fragments (as str and as UTF-8 bytes) interleaved with field slots
+    """
+    
+    def __init__(self, fragments, order=()):
+        self.fragments = tuple(fragments)
+        self.byte_fragments = tuple(f.encode("utf-8") for f in self.fragments)
+        # order[i] is the field that goes between fragments[i] and fragments[i + 1]
+        self.order = tuple(order)
+        self.static = self.fragments[0] if not self.order else None
+        self.static_bytes = self.byte_fragments[0] if not self.order else None
+    
+    def render(self, *fields: str) -> str:
+        if self.static is not None:
+            return self.static
+        parts = [self.fragments[0]]
+        for index, fragment in zip(self.order, self.fragments[1:]):
+            parts.append(fields[index])
+            parts.append(fragment)
+        return "".join(parts)
+    
+    def render_bytes(self, *fields: str) -> bytes:
+        if self.static_bytes is not None:
+            return self.static_bytes
+        encoded = [field.encode("utf-8") for field in fields]
+        parts = [self.byte_fragments[0]]
+        for index, fragment in zip(self.order, self.byte_fragments[1:]):
+            parts.append(encoded[index])
+            parts.append(fragment)
+        return b"".join(parts)
+
+
+# Markers that stand in for the fields while a document is compiled
+_SLOTS = tuple(f"\x00slot{i}\x00" for i in range(3))
+_SLOT_PATTERN = re.compile("\x00slot(\\d)\x00")
+
+
+def _compile(document: str) -> SVGTemplate:
+    # Minify once here, so every render of the template is already compact
+    if MINIFY_SVG:
+        document = minify_svg(document)
+    parts = _SLOT_PATTERN.split(document)
+    return SVGTemplate(parts[0::2], [int(i) for i in parts[1::2]])
+
+
+def _theme_key(theme: str) -> str:
+    """Every theme other than dark renders as light"""
+    return "dark" if theme == "dark" else "light"
+
+
+@lru_cache(maxsize=256)
+def music_template(theme: str, width: int, height: int, show_album: bool) -> SVGTemplate:
+    """Precompiled now-playing template with song, artist and cover slots"""
+    return _compile(_music_document(_SLOTS[0], _SLOTS[1], _SLOTS[2], theme, width, height, show_album))
+
+
+@lru_cache(maxsize=64)
+def default_template(theme: str, width: int, height: int) -> SVGTemplate:
+    """Precompiled (fully static) not-playing template"""
+    return _compile(_default_document(theme, width, height))
+
+
+@lru_cache(maxsize=64)
+def error_template(theme: str, width: int, height: int) -> SVGTemplate:
+    """Precompiled error template with a message slot"""
+    return _compile(_error_document(_SLOTS[0], theme, width, height))
+
+
+def _music_fields(song_name: str, artist_name: str, album_cover_url: str):
+    """Escape and truncate the per-song fields"""
+    # Escape HTML to prevent XSS
+    song_name = html.escape(song_name or "Unknown Song")
+    artist_name = html.escape(artist_name or "Unknown Artist")
+    
+    # Truncate long names
+    if len(song_name) > 30:
+        song_name = song_name[:27] + "..."
+    if len(artist_name) > 30:
+        artist_name = artist_name[:27] + "..."
+    
+    # Default album cover if none provided
+    if not album_cover_url:
+        album_cover_url = PLACEHOLDER_COVER
+    
+    return song_name, artist_name, album_cover_url
+
+
+def generate_music_svg(
+    song_name: str,
+    artist_name: str,
+    album_cover_url: str = "",
+    theme: str = "light",
+    width: int = 400,
+    height: int = 120,
+    show_album: bool = True
+) -> str:
+    """Generate SVG widget for currently playing song"""
+    template = music_template(_theme_key(theme), width, height, show_album)
+    return template.render(*_music_fields(song_name, artist_name, album_cover_url))
+
+
+def generate_music_svg_bytes(
+    song_name: str,
+    artist_name: str,
+    album_cover_url: str = "",
+    theme: str = "light",
+    width: int = 400,
+    height: int = 120,
+    show_album: bool = True
+) -> bytes:
+    """generate_music_svg, encoded as UTF-8 without re-encoding the static markup"""
+    template = music_template(_theme_key(theme), width, height, show_album)
+    return template.render_bytes(*_music_fields(song_name, artist_name, album_cover_url))
+
+
+def generate_default_svg(theme: str = "light", width: int = 400, height: int = 120) -> str:
+    """Generate default SVG when no music is playing"""
+    return default_template(_theme_key(theme), width, height).render()
+
+
+def generate_error_svg(error_message: str = "Error loading widget", theme: str = "light", width: int = 400, height: int = 120) -> str:
+    """Generate SVG widget for error state"""
+    return error_template(_theme_key(theme), width, height).render(html.escape(error_message))
+
+
 class SVGGenerator:
     """Legacy class for backwards compatibility"""
     
@@ -0,0 +1,130 @@
+"""
+SVG output stage
+Minifies widget markup and serves gzip/brotli bodies negotiated from Accept-Encoding.
+Compressed variants are computed once and kept alongside the rendered body.
+"""
+import gzip
+import os
+import re
+import threading
+from typing import Dict, Optional, Tuple, Union
+
+# Brotli is optional - without it only gzip is offered
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MINIFY_SVG = os.getenv("MINIFY_SVG", "true").lower() != "false"
+COMPRESS_SVG = os.getenv("COMPRESS_SVG", "true").lower() != "false"
+
+# Bodies smaller than this aren't worth the Content-Encoding overhead
+COMPRESS_MIN_BYTES = 256
+
+_COMMENT = re.compile(r"<!--.*?-->", re.S)
+_BETWEEN_TAGS = re.compile(r">\s+<")
+_RUNS = re.compile(r"\s{2,}")
+_STYLE = re.compile(r"(<style>)(.*?)(</style>)", re.S)
+_CSS_PUNCT = re.compile(r"\s*([{};:,])\s*")
+_FONT_FAMILY = re.compile(r"font-family:([^;}]+);?")
+
+
+def _minify_css(css: str) -> str:
+    """Compact a <style> block and hoist a font-family shared by every rule onto text"""
+    css = _CSS_PUNCT.sub(r"\1", css.strip())
+    families = set(_FONT_FAMILY.findall(css))
+    if len(families) == 1 and css.count("font-family:") > 1:
+        css = "text{font-family:%s}" % families.pop() + _FONT_FAMILY.sub("", css)
+    return css.replace(";}", "}")
+
+
+def minify_svg(svg: str) -> str:
+    """Strip comments and indentation, collapse whitespace and compact the stylesheet"""
+    svg = _COMMENT.sub("", svg)
+    svg = _BETWEEN_TAGS.sub("><", svg)
+    svg = _RUNS.sub(" ", svg)
+    svg = _STYLE.sub(lambda m: m.group(1) + _minify_css(m.group(2)) + m.group(3), svg)
+    return svg.strip()
+
+
+def available_encodings() -> Tuple[str, ...]:
+    """Content codings we can produce, in order of preference"""
+    if not COMPRESS_SVG:
+        return ()
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+class EncodedSVG:
+    """A rendered SVG body plus its compressed variants, computed on first use"""
+
+    __slots__ = ("body", "_encoded", "_lock")
+
+    def __init__(self, body: Union[bytes, str]):
+        self.body = body.encode("utf-8") if isinstance(body, str) else body
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding: str) -> bytes:
+        """The body in the given content coding ("br" or "gzip")"""
+        data = self._encoded.get(encoding)
+        if data is None:
+            with self._lock:
+                data = self._encoded.get(encoding)
+                if data is None:
+                    if encoding == "br":
+                        data = brotli.compress(self.body, mode=brotli.MODE_TEXT, quality=11)
+                    else:
+                        data = gzip.compress(self.body, compresslevel=9, mtime=0)
+                    self._encoded[encoding] = data
+        return data
+
+    def negotiate(self, accept_encodings) -> Tuple[bytes, Dict[str, str]]:
+        """
+        Pick the body for a request's Accept-Encoding (a werkzeug Accept object).
+        Returns (body, extra headers).
+        """
+        headers = {"Vary": "Accept-Encoding"}
+        encodings = available_encodings()
+        if not encodings or len(self.body) < COMPRESS_MIN_BYTES:
+            return self.body, headers
+
+        encoding = accept_encodings.best_match(encodings) if accept_encodings else None
+        if encoding is None:
+            return self.body, headers
+
+        headers["Content-Encoding"] = encoding
+        return self.encoded(encoding), headers
+
+
+def encoded_etag(etag: str, encoding: Optional[str]) -> str:
+    """Per-coding strong ETag (compressed bytes differ from the identity body)"""
+    return f"{etag}-{encoding}" if encoding else etag
+
+
+def matched_etag(if_none_match, etag: str) -> Optional[str]:
+    """The per-coding ETag (of any coding we serve) that If-None-Match names, or None"""
+    for encoding in (None,) + available_encodings():
+        tag = encoded_etag(etag, encoding)
+        if if_none_match.contains_weak(tag):
+            return tag
+    return None
+
+
+def etag_matches(if_none_match, etag: str) -> bool:
+    """If-None-Match check that accepts the ETag of any coding we serve"""
+    return matched_etag(if_none_match, etag) is not None
+
+
+def not_modified_headers(matched: str) -> Dict[str, str]:
+    """
+    Headers a 304 for an SVG must repeat from the 200 it stands for (RFC 9110
+    15.4.5): the validator the client matched and Vary
+    """
+    return {"ETag": f'"{matched}"', "Vary": "Accept-Encoding"}
+
+
+def as_encoded(svg: Union["EncodedSVG", bytes, str, None]) -> Optional["EncodedSVG"]:
+    """Wrap a plain body so every response path can negotiate encodings"""
+    if svg is None or isinstance(svg, EncodedSVG):
+        return svg
+    return EncodedSVG(svg)
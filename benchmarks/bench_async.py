@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Benchmark: sync Flask entry point vs async (ASGI) entry point
+
+Both apps are served in their own subprocess against a local stub KuGouMusicApi
+(see stub_upstream.py, also run as a subprocess). Firebase is replaced by fixed
+in-memory credentials and a no-op current_song write, so the numbers isolate how
+many widget requests one process can keep in flight while waiting on the upstream.
+
+Usage:
+    python benchmarks/bench_async.py --requests 1000 --concurrency 200 --latency 0.2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+from harness import API_DIR, percentile, serve_wsgi, spawn, start_stub, stop, wait_until_ready
+
+
+def prepare_index(upstream_url):
+    """Import the widget app with Firebase swapped for fixed stub credentials"""
+    sys.path.insert(0, API_DIR)
+    import index
+
+    from storage import MemoryStorage
+
+    creds = {'api_url': upstream_url, 'userid': 'bench', 'token': 'bench'}
+    index.storage = MemoryStorage()
+    index.get_kugou_credentials = lambda user_id, deadline=None: creds
+    index.record_current_song = lambda user_id, song: False
+    return index
+
+
+def serve_sync(port, upstream_url, threads):
+    """Serve the Flask app with a fixed pool of worker threads"""
+    index = prepare_index(upstream_url)
+    serve_wsgi(index.app, port, threads)
+
+
+def serve_async(port, upstream_url):
+    """Serve the ASGI app with hypercorn on a single event loop"""
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    prepare_index(upstream_url)
+    import asgi
+
+    config = Config()
+    config.bind = [f"127.0.0.1:{port}"]
+    config.accesslog = None
+    config.backlog = 1024
+    asyncio.run(serve(asgi.app, config))
+
+
+async def run_load(base_url, total, concurrency):
+    """Fire total widget requests with at most concurrency in flight"""
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        async def one(i):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    # Distinct users so single-flight coalescing doesn't hide upstream waits
+                    response = await client.get('/', params={'user_id': f'bench-{i}'})
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - started
+
+    return elapsed, sorted(latencies), errors
+
+
+def bench_mode(mode, port, upstream_url, args):
+    server = spawn([
+        os.path.abspath(__file__),
+        '--serve', mode, '--port', str(port),
+        '--upstream', upstream_url, '--sync-threads', str(args.sync_threads)
+    ])
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_ready(base_url)
+        # Warm up connection pools before measuring
+        asyncio.run(run_load(base_url, min(args.concurrency, args.requests), args.concurrency))
+        return asyncio.run(run_load(base_url, args.requests, args.concurrency))
+    finally:
+        stop(server)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.2, help='stub upstream latency in seconds')
+    parser.add_argument('--sync-threads', type=int, default=8, help='worker threads for the sync server')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--serve', choices=['sync', 'async'], help=argparse.SUPPRESS)
+    parser.add_argument('--upstream', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve == 'sync':
+        serve_sync(args.port, args.upstream, args.sync_threads)
+        return
+    if args.serve == 'async':
+        serve_async(args.port, args.upstream)
+        return
+
+    stub, upstream_url = start_stub(args.port + 10, args.latency)
+    print(f"Stub upstream: {upstream_url} (latency {args.latency * 1000:.0f}ms)")
+    print(f"{args.requests} requests, concurrency {args.concurrency}, "
+          f"sync server threads {args.sync_threads}\n")
+    print(f"{'mode':<8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+
+    try:
+        for offset, mode in enumerate(['sync', 'async']):
+            elapsed, latencies, errors = bench_mode(mode, args.port + offset, upstream_url, args)
+            print(f"{mode:<8}{args.requests / elapsed:>10.1f}"
+                  f"{percentile(latencies, 50) * 1000:>10.1f}"
+                  f"{percentile(latencies, 95) * 1000:>10.1f}"
+                  f"{percentile(latencies, 99) * 1000:>10.1f}"
+                  f"{errors:>8}")
+    finally:
+        stop(stub)
+
+
+if __name__ == '__main__':
+    main()
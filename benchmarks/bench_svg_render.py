@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: precompiled SVG templates vs rebuilding the f-string document
+
+"legacy" escapes the fields and rebuilds the whole document per call, as the
+generators did before templates; "template" is the current generate_* path.
+Reports time per render and the transient memory one render allocates.
+
+Usage:
+    python benchmarks/bench_svg_render.py --iterations 20000
+"""
+import argparse
+import html
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+
+import svg_generator
+from svg_output import MINIFY_SVG, minify_svg
+from svg_generator import (
+    generate_music_svg, generate_music_svg_bytes, generate_default_svg, generate_error_svg
+)
+
+SONG = ("告白气球", "周杰伦", "https://imge.kugou.com/stdmusic/240/20170418/20170418173403349763.jpg")
+
+
+def legacy_music():
+    fields = svg_generator._music_fields(*SONG)
+    return svg_generator._music_document(*fields, "dark", 400, 120, True)
+
+
+def legacy_music_bytes():
+    return legacy_music().encode("utf-8")
+
+
+def legacy_default():
+    return svg_generator._default_document("dark", 400, 120)
+
+
+def legacy_error():
+    return svg_generator._error_document(html.escape("Service temporarily unavailable"), "dark", 400, 120)
+
+
+CASES = [
+    ("music (str)", legacy_music, lambda: generate_music_svg(*SONG, theme="dark")),
+    ("music (bytes)", legacy_music_bytes, lambda: generate_music_svg_bytes(*SONG, theme="dark")),
+    ("default", legacy_default, lambda: generate_default_svg("dark")),
+    ("error", legacy_error, lambda: generate_error_svg("Service temporarily unavailable", "dark")),
+]
+
+
+def minified(output):
+    """Legacy output as the templates emit it (templates are minified once at compile time)"""
+    if not MINIFY_SVG:
+        return output
+    if isinstance(output, bytes):
+        return minify_svg(output.decode("utf-8")).encode("utf-8")
+    return minify_svg(output)
+
+
+def time_per_call(fn, iterations):
+    fn()  # compile/warm caches outside the measurement
+    return min(timeit.repeat(fn, number=iterations, repeat=3)) / iterations
+
+
+def peak_bytes_per_call(fn):
+    fn()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    del result
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'case':<16}{'legacy µs':>11}{'template µs':>13}{'speedup':>9}{'legacy B':>10}{'template B':>12}")
+    for name, legacy, template in CASES:
+        assert minified(legacy()) == template(), f"{name}: template output differs from legacy"
+        legacy_time = time_per_call(legacy, args.iterations)
+        template_time = time_per_call(template, args.iterations)
+        print(f"{name:<16}{legacy_time * 1e6:>11.2f}{template_time * 1e6:>13.2f}"
+              f"{legacy_time / template_time:>8.1f}x"
+              f"{peak_bytes_per_call(legacy):>10}{peak_bytes_per_call(template):>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+In-process stand-in for firebase_admin.db
+
+Implements the part of the Realtime Database reference API the widget uses
+(get/set/update/delete/child and shallow gets) over a plain dict,
+with an optional per-call delay to model the network round trip.
+
+    database = FakeDatabase(seed_users(100, "http://127.0.0.1:3000"), latency=0.02)
+    install(index, database)
+"""
+import copy
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+def _split(path: Optional[str]):
+    return [part for part in (path or '').split('/') if part]
+
+
+class FakeDatabase:
+    """The whole database: a nested dict plus read/write counters"""
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None, latency: float = 0.0):
+        self.data = data or {}
+        self.latency = latency
+        self.reads = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+
+    def reference(self, path: Optional[str] = None) -> "FakeReference":
+        return FakeReference(self, _split(path))
+
+    def _round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _get(self, parts, shallow=False):
+        self._round_trip()
+        with self._lock:
+            self.reads += 1
+            node = self.data
+            for part in parts:
+                node = node.get(part) if isinstance(node, dict) else None
+            if shallow and isinstance(node, dict):
+                return {key: True for key in node}
+            # Like the real client, callers get their own copy
+            return copy.deepcopy(node) if node not in ({}, None) else None
+
+    def _set(self, parts, value):
+        self._round_trip()
+        with self._lock:
+            self.writes += 1
+            if not parts:
+                self.data = copy.deepcopy(value) or {}
+                return
+            parent = self.data
+            for part in parts[:-1]:
+                child = parent.get(part)
+                if not isinstance(child, dict):
+                    child = parent[part] = {}
+                parent = child
+            if value is None:
+                parent.pop(parts[-1], None)
+            else:
+                parent[parts[-1]] = copy.deepcopy(value)
+
+    def stats(self) -> Dict[str, int]:
+        return {"reads": self.reads, "writes": self.writes}
+
+
+class FakeReference:
+    """firebase_admin.db.Reference"""
+
+    def __init__(self, database: FakeDatabase, parts):
+        self._database = database
+        self._parts = parts
+
+    @property
+    def path(self) -> str:
+        return '/' + '/'.join(self._parts)
+
+    def child(self, path: str) -> "FakeReference":
+        return FakeReference(self._database, self._parts + _split(path))
+
+    def get(self, shallow: bool = False):
+        return self._database._get(self._parts, shallow)
+
+    def set(self, value):
+        self._database._set(self._parts, value)
+
+    def update(self, values: Dict[str, Any]):
+        for key, value in values.items():
+            self._database._set(self._parts + _split(key), value)
+
+    def delete(self):
+        self._database._set(self._parts, None)
+
+
+def seed_users(count: int, api_url: str, with_current_song: bool = True) -> Dict[str, Any]:
+    """Database contents for users user-0..user-{count-1}, all pointing at api_url"""
+    users = {}
+    for i in range(count):
+        user = {
+            'kugou_credentials': {
+                'api_url': api_url,
+                'userid': str(100000 + i),
+                'token': f'token-{i}',
+                'setup_at': int(time.time())
+            }
+        }
+        if with_current_song:
+            user['current_song'] = {
+                'name': f'Cached song {i}',
+                'artist': 'Cached artist',
+                'cover': '',
+                'updated_at': int(time.time())
+            }
+        users[f'user-{i}'] = user
+    return {'users': users}
+
+
+def install(index, database: FakeDatabase):
+    """Point api/index.py's Firebase storage backend at the fake database"""
+    from storage import FirebaseStorage
+
+    index.storage = FirebaseStorage(database)
@@ -0,0 +1,88 @@
+"""
+Shared benchmark plumbing
+Subprocess management for the stub upstream and the app servers, a pooled WSGI
+server for the Flask app, and latency percentiles.
+"""
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'api')
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def serve_wsgi(app, port, threads):
+    """Serve a WSGI app with a fixed pool of worker threads (blocks)"""
+    from werkzeug.serving import BaseWSGIServer
+
+    class PooledWSGIServer(BaseWSGIServer):
+        request_queue_size = 1024
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._pool = ThreadPoolExecutor(max_workers=threads)
+
+        def process_request(self, request, client_address):
+            self._pool.submit(self._process_request_worker, request, client_address)
+
+        def _process_request_worker(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    PooledWSGIServer('127.0.0.1', port, app).serve_forever()
+
+
+def wait_until_ready(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"Server at {base_url} did not come up")
+
+
+def spawn(command):
+    return subprocess.Popen(
+        [sys.executable] + command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def start_stub(port, latency, error_rate=0.0):
+    """Run stub_upstream.py in its own process so it doesn't share a GIL with the load"""
+    stub = spawn([
+        os.path.join(BENCH_DIR, 'stub_upstream.py'),
+        '--port', str(port), '--latency', str(latency), '--error-rate', str(error_rate)
+    ])
+    upstream_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            httpx.get(f"{upstream_url}/health", timeout=1)
+            return stub, upstream_url
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    stub.terminate()
+    raise RuntimeError("Stub upstream did not come up")
+
+
+def stop(process):
+    process.terminate()
+    process.wait()
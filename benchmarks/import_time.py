@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Cold-start report: import-time breakdown of the Vercel function
+
+Imports api/index.py under `python -X importtime` in a fresh interpreter and
+prints the total plus the slowest modules it pulls in. It then serves the demo
+and static routes in another fresh interpreter and checks that none of the
+lazily loaded dependencies were imported. Exits non-zero on a regression, so
+it can run in CI.
+
+Usage:
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --budget-ms 800 --top 15
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api')
+
+# Dependencies that must only load when a route first needs them
+LAZY_MODULES = ('firebase_admin', 'google.auth', 'kugou_client', 'requests', 'PIL')
+
+# Routes that must be served without touching LAZY_MODULES
+COLD_ROUTES = ('/?user_id=demo', '/?user_id=demo&theme=dark', '/health')
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+_CHECK_LAZY = """
+import sys
+import index
+client = index.app.test_client()
+for route in {routes!r}:
+    assert client.get(route).status_code == 200, route
+loaded = sorted(
+    name for name in sys.modules
+    if any(name == lazy or name.startswith(lazy + '.') for lazy in {lazy!r})
+)
+print('LOADED:' + ','.join(loaded))
+"""
+
+
+def fresh_env():
+    """
+    Environment for the child interpreters: no Firebase credentials, and covers
+    linked rather than embedded (deployed demo widgets get theirs at build time)
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1', EMBED_COVERS='false')
+    env.pop('FIREBASE_CREDENTIALS', None)
+    return env
+
+
+def import_times():
+    """
+    [(self_us, cumulative_us, depth, module)] for `import index` and everything it
+    imported, in import order (interpreter startup imports are dropped)
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import index'],
+        cwd=API_DIR, env=fresh_env(), capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((int(self_us), int(cumulative_us), len(indent) // 2, module))
+
+    # A module is reported after its imports, so index's subtree is the run of
+    # nested rows right before it
+    end = next(i for i, row in enumerate(rows) if row[3] == 'index' and row[2] == 0)
+    start = end
+    while start > 0 and rows[start - 1][2] > 0:
+        start -= 1
+    return rows[start:end + 1]
+
+
+def lazily_loaded_on_cold_routes():
+    """LAZY_MODULES that got imported while serving COLD_ROUTES"""
+    result = subprocess.run(
+        [sys.executable, '-c', _CHECK_LAZY.format(routes=COLD_ROUTES, lazy=LAZY_MODULES)],
+        cwd=API_DIR, env=fresh_env(), capture_output=True, text=True, check=True
+    )
+    marker = next(line for line in result.stdout.splitlines() if line.startswith('LOADED:'))
+    return [name for name in marker[len('LOADED:'):].split(',') if name]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--top', type=int, default=10, help='slowest modules to list')
+    parser.add_argument('--budget-ms', type=float, help='fail if importing index takes longer')
+    args = parser.parse_args()
+
+    rows = import_times()
+    total_ms = next(cumulative for _, cumulative, _, module in rows if module == 'index') / 1000
+
+    # Modules index imports directly, by cumulative time
+    direct = sorted(
+        ((cumulative, module) for _, cumulative, depth, module in rows if depth == 1),
+        reverse=True
+    )
+    print(f"import index: {total_ms:.1f} ms\n")
+    print(f"{'imported by index':<32}{'cumulative ms':>14}")
+    for cumulative, module in direct[:args.top]:
+        print(f"{module:<32}{cumulative / 1000:>14.1f}")
+
+    # Heaviest packages overall by their own (self) time
+    by_package = {}
+    for self_us, _, _, module in rows:
+        package = module.split('.')[0]
+        by_package[package] = by_package.get(package, 0) + self_us
+    print(f"\n{'package':<32}{'self ms':>14}")
+    for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{package:<32}{self_us / 1000:>14.1f}")
+
+    failed = False
+    eager = sorted({module for _, _, _, module in rows
+                    if any(module == lazy or module.startswith(lazy + '.') for lazy in LAZY_MODULES)})
+    loaded = lazily_loaded_on_cold_routes()
+    print()
+    if eager or loaded:
+        print(f"❌ Lazy dependencies loaded at startup or by {', '.join(COLD_ROUTES)}: "
+              f"{', '.join(sorted(set(eager) | set(loaded)))}")
+        failed = True
+    else:
+        print(f"✅ {', '.join(LAZY_MODULES)} stay unloaded for demo/static routes")
+
+    if args.budget_ms is not None:
+        if total_ms > args.budget_ms:
+            print(f"❌ import index took {total_ms:.1f} ms, budget {args.budget_ms:.0f} ms")
+            failed = True
+        else:
+            print(f"✅ import index within {args.budget_ms:.0f} ms budget")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
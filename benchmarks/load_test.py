@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Offline load test: per-route throughput and latency of the Flask app
+
+Runs everything locally, without a live Firebase or KuGouMusicApi:
+  - the app is served in its own process on the --storage backend seeded with
+    --users users: "firebase" is the Firebase backend over
+    fake_firebase.FakeDatabase (with --firebase-latency per call), "memory" and
+    "sqlite" are the self-hosted backends
+  - their credentials point at stub_upstream.py (another process) with the
+    given latency and error rate
+Each route scenario is then driven at --concurrency and reported with req/s and
+p50/p95/p99. Environment variables pass through to the app, e.g.
+    SERVE_MODE=stale-while-revalidate python benchmarks/load_test.py
+
+Usage:
+    python benchmarks/load_test.py --requests 500 --concurrency 50 --latency 0.1 --error-rate 0.05
+    python benchmarks/load_test.py --routes widget,batch --firebase-latency 0.03
+    python benchmarks/load_test.py --storage sqlite
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import httpx
+
+from fake_firebase import FakeDatabase, install, seed_users
+from harness import API_DIR, percentile, serve_wsgi, spawn, start_stub, stop, wait_until_ready
+
+BATCH_SIZE = 10
+
+# name -> path for the i-th request, given the number of seeded users
+SCENARIOS = {
+    'demo': lambda i, users: '/?user_id=demo',
+    'widget': lambda i, users: f'/?user_id=user-{i % users}',
+    'widget-dark-300': lambda i, users: f'/?user_id=user-{i % users}&theme=dark&width=300&height=90',
+    'batch': lambda i, users: '/batch?user_ids=' + ','.join(
+        f'user-{(i * BATCH_SIZE + j) % users}' for j in range(BATCH_SIZE)
+    ),
+    'user-info': lambda i, users: f'/user/user-{i % users}',
+    'health': lambda i, users: '/health',
+}
+
+
+def seeded_storage(kind, users, upstream_url):
+    """A storage backend of the given kind holding the seeded users"""
+    from storage import MemoryStorage, SQLiteStorage
+
+    seeded = seed_users(users, upstream_url)['users']
+    if kind == 'memory':
+        return MemoryStorage(seeded)
+
+    backend = SQLiteStorage(os.path.join(tempfile.mkdtemp(prefix='widget-bench-'), 'widget.db'))
+    for user_id, user in seeded.items():
+        backend.set_credentials(user_id, user['kugou_credentials'])
+        backend.set_current_song(user_id, user['current_song'])
+    return backend
+
+
+def serve_app(port, upstream_url, users, storage, firebase_latency, threads):
+    """Serve the Flask app on seeded local storage (runs in the server subprocess)"""
+    # Stub songs point at the real image host - keep cover fetches out of the numbers
+    os.environ.setdefault('EMBED_COVERS', 'false')
+    sys.path.insert(0, API_DIR)
+    import index
+
+    if storage == 'firebase':
+        install(index, FakeDatabase(seed_users(users, upstream_url), latency=firebase_latency))
+    else:
+        index.storage = seeded_storage(storage, users, upstream_url)
+    serve_wsgi(index.app, port, threads)
+
+
+async def run_scenario(base_url, path_for, total, concurrency, users):
+    """Fire total requests with at most concurrency in flight; returns (elapsed, latencies, statuses)"""
+    latencies = []
+    statuses = Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        async def one(i):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await client.get(path_for(i, users))
+                    statuses[response.status_code] += 1
+                except httpx.HTTPError:
+                    statuses['error'] += 1
+                latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - started
+
+    return elapsed, sorted(latencies), statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--users', type=int, default=100, help='seeded users requests cycle through')
+    parser.add_argument('--latency', type=float, default=0.1, help='stub upstream latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of upstream calls that fail')
+    parser.add_argument('--storage', choices=['firebase', 'memory', 'sqlite'], default='firebase',
+                        help='storage backend (firebase = fake Firebase database)')
+    parser.add_argument('--firebase-latency', type=float, default=0.0, help='fake Firebase delay per call')
+    parser.add_argument('--threads', type=int, default=16, help='worker threads for the app server')
+    parser.add_argument('--routes', default=','.join(SCENARIOS), help='comma-separated scenarios to run')
+    parser.add_argument('--port', type=int, default=8775)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--upstream', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve_app(args.port, args.upstream, args.users, args.storage, args.firebase_latency, args.threads)
+        return 0
+
+    routes = [route.strip() for route in args.routes.split(',') if route.strip()]
+    unknown = [route for route in routes if route not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown routes {unknown}; choose from {list(SCENARIOS)}")
+
+    stub, upstream_url = start_stub(args.port + 10, args.latency, args.error_rate)
+    server = spawn([
+        os.path.abspath(__file__), '--serve', '--port', str(args.port), '--upstream', upstream_url,
+        '--users', str(args.users), '--storage', args.storage,
+        '--firebase-latency', str(args.firebase_latency),
+        '--threads', str(args.threads)
+    ])
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    storage = args.storage
+    if storage == 'firebase':
+        storage = f"fake Firebase, latency {args.firebase_latency * 1000:.0f}ms"
+    print(f"Stub upstream: latency {args.latency * 1000:.0f}ms, error rate {args.error_rate:.0%}; "
+          f"storage: {storage}, {args.users} users")
+    print(f"{args.requests} requests per route, concurrency {args.concurrency}, "
+          f"{args.threads} server threads\n")
+    print(f"{'route':<18}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  statuses")
+
+    try:
+        wait_until_ready(base_url)
+        for route in routes:
+            path_for = SCENARIOS[route]
+            # Warm caches and connection pools before measuring
+            asyncio.run(run_scenario(base_url, path_for, min(args.concurrency, args.requests),
+                                     args.concurrency, args.users))
+            elapsed, latencies, statuses = asyncio.run(
+                run_scenario(base_url, path_for, args.requests, args.concurrency, args.users)
+            )
+            print(f"{route:<18}{args.requests / elapsed:>9.1f}"
+                  f"{percentile(latencies, 50) * 1000:>9.1f}"
+                  f"{percentile(latencies, 95) * 1000:>9.1f}"
+                  f"{percentile(latencies, 99) * 1000:>9.1f}  "
+                  + ' '.join(f"{status}:{count}" for status, count in sorted(statuses.items(), key=str)))
+    finally:
+        stop(server)
+        stop(stub)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
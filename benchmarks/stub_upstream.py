@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for a KuGouMusicApi deployment
+
+Serves /user/recentListening with a fixed song after a configurable delay,
+failing a configurable fraction of requests, so the widget can be benchmarked
+without a real upstream. /health answers immediately.
+
+Usage:
+    python benchmarks/stub_upstream.py --port 3000 --latency 0.2 --error-rate 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+STUB_SONG = {
+    'songname': '晴天',
+    'singername': '周杰伦',
+    'img': 'https://imge.kugou.com/stdmusic/240/20150718/20150718120613556308.jpg',
+    'hash': 'STUBHASH0000000000000000000000001'
+}
+
+
+class StubUpstreamHandler(BaseHTTPRequestHandler):
+    """Answers /user/recentListening like KuGouMusicApi does"""
+
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+    error_rate = 0.0
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/health':
+            self._send_json(200, {'status': 1})
+            return
+        if path != '/user/recentListening':
+            self.send_error(404)
+            return
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self.error_rate and random.random() < self.error_rate:
+            self._send_json(500, {'status': 0, 'error_code': 20018, 'data': []})
+            return
+        self._send_json(200, {'status': 1, 'data': [STUB_SONG]})
+
+    def _send_json(self, code, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubUpstreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def start_stub_upstream(port=0, latency=0.0, error_rate=0.0):
+    """Start the stub in a daemon thread; returns (server, base_url)"""
+    handler = type('Handler', (StubUpstreamHandler,), {'latency': latency, 'error_rate': error_rate})
+    server = StubUpstreamServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=3000)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before answering')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests that fail (0-1)')
+    args = parser.parse_args()
+
+    server, url = start_stub_upstream(args.port, args.latency, args.error_rate)
+    print(f"Stub KuGouMusicApi listening on {url} (latency {args.latency}s, error rate {args.error_rate})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Widget payload sizes: legacy markup vs minified, and the gzip/brotli bodies served
+
+Renders each widget kind per theme and prints the bytes a client downloads
+with each content coding.
+
+Usage:
+    python benchmarks/svg_size_report.py
+"""
+import html
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+
+import svg_generator
+from svg_output import EncodedSVG, brotli, minify_svg
+
+SONG = ("告白气球", "周杰伦", "https://imge.kugou.com/stdmusic/240/20170418/20170418173403349763.jpg")
+ERROR_MESSAGE = "Service temporarily unavailable"
+
+
+def legacy_documents(theme):
+    fields = svg_generator._music_fields(*SONG)
+    yield "music", svg_generator._music_document(*fields, theme, 400, 120, True)
+    yield "music (no album)", svg_generator._music_document(*fields, theme, 400, 120, False)
+    yield "default", svg_generator._default_document(theme, 400, 120)
+    yield "error", svg_generator._error_document(html.escape(ERROR_MESSAGE), theme, 400, 120)
+
+
+def main():
+    print(f"{'widget':<24}{'legacy':>8}{'minified':>10}{'gzip':>8}{'brotli':>8}{'saved':>8}")
+    for theme in ("light", "dark"):
+        for name, legacy in legacy_documents(theme):
+            raw = legacy.encode("utf-8")
+            encoded = EncodedSVG(minify_svg(legacy))
+            best = len(encoded.encoded("br")) if brotli is not None else len(encoded.encoded("gzip"))
+            print(f"{theme + ' ' + name:<24}{len(raw):>8}{len(encoded.body):>10}"
+                  f"{len(encoded.encoded('gzip')):>8}"
+                  f"{len(encoded.encoded('br')) if brotli is not None else '-':>8}"
+                  f"{1 - best / len(raw):>7.0%}")
+    print("\ngzip/brotli columns are the minified body; 'saved' is best coding vs legacy raw")
+
+
+if __name__ == '__main__':
+    main()
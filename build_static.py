@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Pre-render static widget variants
+
+Demo, default and error widgets only depend on theme and size, so they are
+rendered once at build time into public/widgets/. Vercel serves those files
+from the edge without invoking the Python function, and api/index.py loads
+them (via manifest.json) instead of rendering at runtime.
+
+Usage:
+    python build_static.py
+    python build_static.py --size 400x120 --size 300x90 --no-embed-covers
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+api_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api')
+sys.path.insert(0, api_dir)
+
+from svg_generator import generate_music_svg_bytes, generate_default_svg, generate_error_svg
+from static_widgets import (
+    DEMO_SONGS, DEFAULT_SIZES, MANIFEST_NAME, SERVICE_ERROR_MESSAGE, STATIC_WIDGETS_DIR,
+    THEMES, variant_path
+)
+
+
+def parse_size(value):
+    try:
+        width, height = value.lower().split('x')
+        return int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"size must look like 400x120, got {value!r}")
+
+
+def demo_covers(embed):
+    """Cover href per demo song: embedded data URI, or the original URL as a fallback"""
+    covers = [song['cover'] for song in DEMO_SONGS]
+    if not embed:
+        return covers
+
+    from cover_cache import covers_enabled, fetch_cover_data_uri
+    if not covers_enabled():
+        print("⚠ Pillow not available - linking demo covers instead of embedding")
+        return covers
+
+    embedded = []
+    for url in covers:
+        try:
+            embedded.append(fetch_cover_data_uri(url))
+            print(f"✓ Embedded cover {url}")
+        except Exception as e:
+            print(f"⚠ Could not embed cover {url}: {e}")
+            embedded.append(url)
+    return embedded
+
+
+def build_variants(sizes, embed_covers):
+    """Yield (relative path, svg bytes) for every static variant"""
+    covers = demo_covers(embed_covers)
+
+    for theme in THEMES:
+        for width, height in sizes:
+            yield (
+                variant_path('default', theme, width, height),
+                generate_default_svg(theme, width, height).encode('utf-8')
+            )
+            yield (
+                variant_path('error', theme, width, height),
+                generate_error_svg(SERVICE_ERROR_MESSAGE, theme, width, height).encode('utf-8')
+            )
+            for index, song in enumerate(DEMO_SONGS):
+                for show_album in (True, False):
+                    yield (
+                        variant_path('demo', theme, width, height, show_album, index),
+                        generate_music_svg_bytes(
+                            song_name=song['name'],
+                            artist_name=song['artist'],
+                            album_cover_url=covers[index],
+                            theme=theme,
+                            width=width,
+                            height=height,
+                            show_album=show_album
+                        )
+                    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-render static widget variants")
+    parser.add_argument('--out', default=STATIC_WIDGETS_DIR, help='output directory')
+    parser.add_argument('--size', type=parse_size, action='append',
+                        help='WIDTHxHEIGHT to render (repeatable, default 400x120)')
+    parser.add_argument('--no-embed-covers', action='store_true',
+                        help='link demo covers instead of embedding them')
+    args = parser.parse_args()
+
+    sizes = args.size or list(DEFAULT_SIZES)
+    manifest = {}
+
+    for path, svg in build_variants(sizes, not args.no_embed_covers):
+        target = os.path.join(args.out, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(svg)
+        manifest[path] = hashlib.sha1(svg).hexdigest()
+
+    with open(os.path.join(args.out, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump({
+            "sizes": [f"{width}x{height}" for width, height in sizes],
+            "variants": manifest
+        }, f, indent=2, sort_keys=True)
+
+    print(f"✅ Wrote {len(manifest)} static widgets to {args.out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,11 +13,29 @@ Usage:
 
 Cron Example (every 5 minutes):
     */5 * * * * cd /path/to/kugou-widget && WIDGET_URL="..." USER_ID="..." ./sync_kugou_listening.py >> /tmp/kugou-sync.log 2>&1
+
+Daemon mode (all users, one long-running process):
+    pip install -r api/requirements.txt
+    export STORAGE_BACKEND=firebase FIREBASE_CREDENTIALS='...' FIREBASE_DATABASE_URL='...'
+    ./sync_kugou_listening.py --daemon --workers 16
+
+    Loads every user with KuGouMusicApi credentials from storage (reloaded every
+    SYNC_USERS_RELOAD seconds) and polls their upstreams directly from a worker
+    pool, writing changed songs straight to storage - no widget requests. Each
+    user is polled every SYNC_ACTIVE_INTERVAL seconds while their song keeps
+    changing, backing off (doubling) to SYNC_IDLE_INTERVAL while it doesn't.
 """
 
+import argparse
+import heapq
+import random
 import requests
 import os
+import signal
 import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 
 # Configuration from environment variables
@@ -27,6 +45,14 @@ USER_ID = os.getenv('USER_ID', 'your_github_username')
 # Optional: Slack/Discord webhook for notifications
 WEBHOOK_URL = os.getenv('NOTIFICATION_WEBHOOK', '')
 
+# Daemon mode: concurrent upstream polls, poll intervals (seconds) and user list refresh
+SYNC_WORKERS = int(os.getenv('SYNC_WORKERS', 8))
+SYNC_ACTIVE_INTERVAL = float(os.getenv('SYNC_ACTIVE_INTERVAL', 30))
+SYNC_IDLE_INTERVAL = float(os.getenv('SYNC_IDLE_INTERVAL', 600))
+SYNC_USERS_RELOAD = float(os.getenv('SYNC_USERS_RELOAD', 300))
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api')
+
 def log(message):
     """Print timestamped log message"""
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -51,42 +77,23 @@ def sync_listening_history():
     try:
         log(f"Syncing listening history for user: {USER_ID}")
         
-        # Access the now-playing endpoint to trigger sync
-        url = f"{WIDGET_URL}/now-playing?user_id={USER_ID}"
+        # The JSON now-playing endpoint resolves (and stores) the song without rendering a widget
+        url = f"{WIDGET_URL}/now-playing"
         
-        response = requests.get(url, timeout=15)
+        response = requests.get(url, params={'user_id': USER_ID}, timeout=15)
         
         if response.status_code == 200:
-            # Try to extract song info from SVG response
-            svg_content = response.text
-            
-            # Simple parsing (SVG contains song info in text elements)
-            song_name = None
-            artist_name = None
-            
-            # Look for song name in SVG
-            if 'Now Playing:' in svg_content:
-                lines = svg_content.split('\n')
-                for i, line in enumerate(lines):
-                    if 'Now Playing:' in line and i + 1 < len(lines):
-                        # Next line usually has the song name
-                        if '<text' in lines[i+1]:
-                            # Extract text between > and <
-                            text = lines[i+1].split('>')[1].split('<')[0] if '>' in lines[i+1] else None
-                            if text and text.strip():
-                                song_name = text.strip()
-                    if song_name and 'by' in line:
-                        # Extract artist
-                        text = line.split('>')[1].split('<')[0] if '>' in line else None
-                        if text and text.strip():
-                            artist_name = text.strip().replace('by ', '')
-                        break
+            data = response.json()
+            song = data.get('song') or {}
+            song_name = song.get('name')
+            artist_name = song.get('artist')
             
-            if song_name:
-                log(f"✓ Synced successfully: {song_name}" + (f" - {artist_name}" if artist_name else ""))
+            if data.get('tier') == 'realtime':
+                log(f"✓ Synced successfully: {song_name} - {artist_name}")
                 return True, {'song': song_name, 'artist': artist_name}
             else:
-                log(f"✓ Sync completed (HTTP 200)")
+                # KuGouMusicApi didn't answer; the widget served what it had
+                log(f"⚠ No real-time data (tier: {data.get('tier')}), showing: {song_name} - {artist_name}")
                 return True, None
         
         else:
@@ -129,8 +136,133 @@ def check_kugou_api_status():
         log(f"⚠ Error checking API status: {e}")
         return False
 
+def song_key(song):
+    """Identity of a song record: the Kugou hash, else name and artist"""
+    return song.get('hash') or (song.get('name'), song.get('artist'))
+
+
+class UserPoller:
+    """Poll schedule for one user: short while their song changes, doubling while it doesn't"""
+    
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.interval = SYNC_ACTIVE_INTERVAL
+        self.last_song = None
+    
+    def next_delay(self, song):
+        """Seconds until the next poll, given this poll's song (None if nothing/failed)"""
+        changed = song is not None and song_key(song) != self.last_song
+        if changed:
+            self.last_song = song_key(song)
+            self.interval = SYNC_ACTIVE_INTERVAL
+        else:
+            self.interval = min(SYNC_IDLE_INTERVAL, self.interval * 2)
+        # Jitter keeps users that started together from polling in lockstep
+        return self.interval * random.uniform(0.9, 1.1), changed
+
+
+def configured_users(index):
+    """
+    Ids of users with complete KuGouMusicApi credentials. Their nodes are read
+    in bulk (concurrently on index.batch_executor) and prime the credentials
+    cache the polls use, so a reload doesn't hold up the scheduler.
+    """
+    users = []
+    nodes = index.storage.get_users(index.storage.list_users(), index.batch_executor)
+    for user_id, user_data in nodes.items():
+        index.prime_user_caches(user_id, user_data)
+        creds = user_data.get('kugou_credentials') or {}
+        if creds.get('api_url') and creds.get('userid') and creds.get('token'):
+            users.append(user_id)
+    return users
+
+
+def run_daemon(workers, stop):
+    """Poll all configured users until stop is set"""
+    sys.path.insert(0, API_DIR)
+    import index
+    
+    if not index.storage.available():
+        log(f"✗ Error: {index.storage.name} storage is not configured")
+        return 1
+    
+    log(f"Sync daemon: {index.storage.name} storage, {workers} workers, "
+        f"intervals {SYNC_ACTIVE_INTERVAL:.0f}-{SYNC_IDLE_INTERVAL:.0f}s")
+    
+    pollers = {}
+    # (due, user_id, poller); entries whose poller was replaced or dropped are skipped
+    schedule = []
+    in_flight = {}
+    next_reload = 0.0
+    polls = changes = 0
+    
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sync') as executor:
+        while not stop.is_set():
+            now = time.monotonic()
+            if now >= next_reload:
+                next_reload = now + SYNC_USERS_RELOAD
+                try:
+                    user_ids = set(configured_users(index))
+                except Exception as e:
+                    log(f"✗ Loading users failed, keeping {len(pollers)}: {e}")
+                else:
+                    for user_id in user_ids - set(pollers):
+                        poller = pollers[user_id] = UserPoller(user_id)
+                        # Spread first polls over one active interval
+                        heapq.heappush(schedule, (now + random.uniform(0, SYNC_ACTIVE_INTERVAL), user_id, poller))
+                    for user_id in set(pollers) - user_ids:
+                        del pollers[user_id]
+                    log(f"Syncing {len(pollers)} users ({polls} polls, {changes} song changes so far)")
+            
+            while schedule and schedule[0][0] <= now and len(in_flight) < workers:
+                _, user_id, poller = heapq.heappop(schedule)
+                if pollers.get(user_id) is poller:
+                    # Fetches and, when the song changed, writes current_song (and its widgets)
+                    in_flight[executor.submit(index.get_song_from_kugou_api, user_id)] = poller
+            
+            # Sleep until the next due poll (if a worker is free), a finished poll or the reload
+            next_due = schedule[0][0] if schedule and len(in_flight) < workers else next_reload
+            timeout = max(0.0, min(next_reload, next_due, time.monotonic() + 1.0) - time.monotonic())
+            if not in_flight:
+                stop.wait(timeout)
+                continue
+            
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                poller = in_flight.pop(future)
+                try:
+                    song = future.result()
+                except Exception as e:
+                    log(f"✗ Poll failed for {poller.user_id}: {e}")
+                    song = None
+                polls += 1
+                delay, changed = poller.next_delay(song)
+                if changed:
+                    changes += 1
+                    log(f"✓ {poller.user_id}: {song.get('name')} - {song.get('artist')}")
+                if pollers.get(poller.user_id) is poller:
+                    heapq.heappush(schedule, (time.monotonic() + delay, poller.user_id, poller))
+        
+        log(f"Stopping: waiting for {len(in_flight)} in-flight polls")
+    
+    log(f"Sync daemon stopped after {polls} polls, {changes} song changes")
+    return 0
+
+
 def main():
     """Main sync routine"""
+    parser = argparse.ArgumentParser(description="Sync Kugou listening history")
+    parser.add_argument('--daemon', action='store_true',
+                        help='poll every configured user until stopped, writing straight to storage')
+    parser.add_argument('--workers', type=int, default=SYNC_WORKERS, help='concurrent upstream polls (daemon)')
+    args = parser.parse_args()
+    
+    if args.daemon:
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        signal.signal(signal.SIGINT, lambda *_: stop.set())
+        return run_daemon(args.workers, stop)
+    
     log("=" * 60)
     log("Kugou Listening History Sync")
     log("=" * 60)
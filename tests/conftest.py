@@ -0,0 +1,86 @@
+"""
+Shared test setup
+Imports the api modules the way Vercel does (api/ on sys.path) and provides
+a controllable clock plus an index module running on in-memory storage.
+"""
+import os
+import socket
+import sys
+
+import pytest
+
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api')
+if API_DIR not in sys.path:
+    sys.path.insert(0, API_DIR)
+
+# Keep cover fetches off the network
+os.environ.setdefault('EMBED_COVERS', 'false')
+
+TEST_API_URL = 'http://kugou-api.invalid'
+
+TEST_USERS = {
+    'alice': {
+        'kugou_credentials': {'api_url': TEST_API_URL, 'userid': '123456', 'token': 'secret-token'},
+        'current_song': {'name': 'Stored Song', 'artist': 'Stored Artist', 'cover': '', 'updated_at': 1}
+    }
+}
+
+
+class FakeClock:
+    """Stands in for time.monotonic; tests move it with advance()"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A FakeClock installed as time.monotonic"""
+    fake = FakeClock()
+    monkeypatch.setattr('time.monotonic', fake)
+    return fake
+
+
+@pytest.fixture
+def unreachable_host():
+    """
+    http:// URL of a listener whose accept queue is full: the kernel drops
+    further SYNs, so connects hang until their timeout (a firewalled upstream)
+    """
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(0)
+    port = server.getsockname()[1]
+    fillers = []
+    for _ in range(8):
+        filler = socket.socket()
+        filler.setblocking(False)
+        filler.connect_ex(('127.0.0.1', port))
+        fillers.append(filler)
+    yield f'http://127.0.0.1:{port}'
+    for sock in fillers + [server]:
+        sock.close()
+
+
+@pytest.fixture
+def app_index(monkeypatch):
+    """index with one configured user (alice) on memory storage and a fresh breaker and caches"""
+    import index
+    from circuit_breaker import CircuitBreaker
+    from storage import MemoryStorage
+
+    monkeypatch.setattr(index, 'storage', MemoryStorage(TEST_USERS))
+    monkeypatch.setattr(index, 'upstream_breaker', CircuitBreaker(
+        name='test', failure_threshold=2, recovery_seconds=30, max_recovery_seconds=600, jitter=0
+    ))
+    for cache in (index.kugou_creds_cache, index.last_song_cache, index.recent_song_cache):
+        cache.clear()
+    yield index
+    for cache in (index.kugou_creds_cache, index.last_song_cache, index.recent_song_cache):
+        cache.clear()
@@ -0,0 +1,72 @@
+"""TTLCache expiry, LRU eviction and their counters"""
+from cache import TTLCache
+
+
+def test_hit_and_miss_counters(clock):
+    cache = TTLCache(maxsize=4, ttl=10)
+    assert cache.get('a') is None
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+    assert stats['hit_ratio'] == 0.5
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = TTLCache(maxsize=4, ttl=10)
+    cache.set('a', 1)
+    clock.advance(9.9)
+    assert cache.get('a') == 1
+
+    clock.advance(0.2)
+    assert cache.get('a', 'gone') == 'gone'
+    stats = cache.stats()
+    assert stats['expirations'] == 1
+    assert stats['size'] == 0
+
+
+def test_per_entry_ttl_overrides_default(clock):
+    cache = TTLCache(maxsize=4, ttl=10)
+    cache.set('short', 1, ttl=1)
+    cache.set('long', 2)
+    clock.advance(2)
+    assert cache.get('short') is None
+    assert cache.get('long') == 2
+
+
+def test_evicts_least_recently_used(clock):
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    # Reading a makes b the least recently used
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_overwrite_does_not_evict(clock):
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.set('a', 3)
+    assert len(cache) == 2
+    assert cache.get('a') == 3
+    assert cache.stats()['evictions'] == 0
+
+
+def test_delete_and_clear_keep_counters(clock):
+    cache = TTLCache(maxsize=4, ttl=10)
+    cache.set('a', 1)
+    cache.get('a')
+    assert cache.delete('a')
+    assert not cache.delete('a')
+
+    cache.set('b', 2)
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.stats()['hits'] == 1
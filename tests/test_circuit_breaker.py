@@ -0,0 +1,129 @@
+"""Circuit breaker state machine, and how the KuGouMusicApi call path drives it"""
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from deadline import Deadline
+
+from conftest import TEST_API_URL
+
+
+def make_breaker(**kwargs):
+    options = dict(failure_threshold=3, recovery_seconds=30, max_recovery_seconds=120, jitter=0)
+    options.update(kwargs)
+    return CircuitBreaker(**options)
+
+
+def test_opens_after_threshold_consecutive_failures(clock):
+    breaker = make_breaker()
+    for _ in range(2):
+        breaker.record_failure('a')
+    assert breaker.state('a') == CLOSED
+    assert breaker.allow('a')
+
+    breaker.record_failure('a')
+    assert breaker.state('a') == OPEN
+    assert not breaker.allow('a')
+    assert breaker.stats()['opened'] == 1
+    assert breaker.stats()['rejected'] == 1
+
+
+def test_success_resets_failure_count(clock):
+    breaker = make_breaker()
+    breaker.record_failure('a')
+    breaker.record_failure('a')
+    breaker.record_success('a')
+    breaker.record_failure('a')
+    assert breaker.state('a') == CLOSED
+
+
+def test_circuits_are_per_key(clock):
+    breaker = make_breaker(failure_threshold=1)
+    breaker.record_failure('a')
+    assert not breaker.allow('a')
+    assert breaker.allow('b')
+
+
+def test_single_probe_after_recovery_delay(clock):
+    breaker = make_breaker(failure_threshold=1)
+    breaker.record_failure('a')
+
+    clock.advance(29)
+    assert not breaker.allow('a')
+
+    clock.advance(2)
+    assert breaker.allow('a')
+    assert breaker.state('a') == HALF_OPEN
+    # Only one probe at a time
+    assert not breaker.allow('a')
+    assert breaker.stats()['probes'] == 1
+
+
+def test_successful_probe_closes(clock):
+    breaker = make_breaker(failure_threshold=1)
+    breaker.record_failure('a')
+    clock.advance(31)
+    assert breaker.allow('a')
+
+    breaker.record_success('a')
+    assert breaker.state('a') == CLOSED
+    assert breaker.allow('a')
+
+
+def test_failed_probe_reopens_with_doubled_delay(clock):
+    breaker = make_breaker(failure_threshold=1)
+    breaker.record_failure('a')
+    clock.advance(31)
+    assert breaker.allow('a')
+
+    breaker.record_failure('a')
+    assert breaker.state('a') == OPEN
+    clock.advance(59)
+    assert not breaker.allow('a')
+    clock.advance(2)
+    assert breaker.allow('a')
+
+
+def test_recovery_delay_is_capped(clock):
+    breaker = make_breaker(failure_threshold=1, recovery_seconds=30, max_recovery_seconds=60)
+    breaker.record_failure('a')
+    for _ in range(4):
+        clock.advance(61)
+        assert breaker.allow('a')
+        breaker.record_failure('a')
+    clock.advance(61)
+    assert breaker.allow('a')
+
+
+def test_unreported_probe_is_replaced_after_recovery_period(clock):
+    breaker = make_breaker(failure_threshold=1)
+    breaker.record_failure('a')
+    clock.advance(31)
+    assert breaker.allow('a')
+
+    clock.advance(29)
+    assert not breaker.allow('a')
+    clock.advance(2)
+    assert breaker.allow('a')
+    assert breaker.stats()['probes'] == 2
+
+
+def test_spent_deadline_does_not_take_the_probe(app_index, clock):
+    """A call skipped for lack of time must leave the half-open probe to a call that can report back"""
+    breaker = app_index.upstream_breaker
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure(TEST_API_URL)
+    clock.advance(31)
+
+    assert app_index.prepare_kugou_call('alice', Deadline(0)) is None
+    assert breaker.state(TEST_API_URL) == OPEN
+
+    call = app_index.prepare_kugou_call('alice', Deadline(5))
+    assert call is not None and call[0] == TEST_API_URL
+    assert breaker.state(TEST_API_URL) == HALF_OPEN
+
+
+def test_open_circuit_skips_the_call(app_index, clock):
+    breaker = app_index.upstream_breaker
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure(TEST_API_URL)
+
+    assert app_index.prepare_kugou_call('alice', Deadline(5)) is None
+    assert breaker.stats()['rejected'] == 1
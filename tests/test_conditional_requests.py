@@ -0,0 +1,62 @@
+"""ETag revalidation: 304s repeat the validator and Vary of the 200 they stand for"""
+import asyncio
+
+import pytest
+import requests
+
+from test_upstream import FakeSession, use_session
+
+GZIP = {'Accept-Encoding': 'gzip'}
+
+
+@pytest.fixture
+def client(app_index, monkeypatch):
+    # Upstream down: widgets come from alice's stored song
+    use_session(monkeypatch, app_index, FakeSession(requests.ConnectionError('down')))
+    return app_index.app.test_client()
+
+
+@pytest.mark.parametrize('path', [
+    '/?user_id=demo',
+    '/?user_id=alice&theme=dark',
+    '/batch?user_ids=alice,demo&format=svg'
+])
+@pytest.mark.parametrize('accept', [{}, GZIP])
+def test_svg_304_carries_the_matched_coding_etag_and_vary(client, path, accept):
+    first = client.get(path, headers=accept)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    if accept:
+        assert etag.endswith('-gzip"')
+
+    second = client.get(path, headers=dict(accept, **{'If-None-Match': etag}))
+    assert second.status_code == 304
+    assert second.headers['ETag'] == etag
+    assert second.headers['Vary'] == 'Accept-Encoding'
+    assert second.headers['Cache-Control'] == first.headers['Cache-Control']
+
+
+@pytest.mark.parametrize('path', ['/now-playing?user_id=alice', '/batch?user_ids=alice,demo'])
+def test_json_304_carries_the_etag(client, path):
+    first = client.get(path)
+    etag = first.headers['ETag']
+
+    second = client.get(path, headers={'If-None-Match': etag})
+    assert second.status_code == 304
+    assert second.headers['ETag'] == etag
+
+
+def test_asgi_svg_304_carries_the_matched_coding_etag_and_vary():
+    import asgi
+
+    async def check():
+        client = asgi.app.test_client()
+        first = await client.get('/?user_id=demo', headers=GZIP)
+        etag = first.headers['ETag']
+        second = await client.get('/?user_id=demo', headers=dict(GZIP, **{'If-None-Match': etag}))
+        return etag, second
+
+    etag, second = asyncio.run(check())
+    assert second.status_code == 304
+    assert second.headers['ETag'] == etag
+    assert second.headers['Vary'] == 'Accept-Encoding'
@@ -0,0 +1,155 @@
+"""Cover downloads: user-supplied URLs get bounded time, size and pixel counts"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import cover_cache
+
+
+def image_bytes(size, fmt, mode="RGB"):
+    out = BytesIO()
+    Image.new(mode, size).save(out, format=fmt)
+    return out.getvalue()
+
+
+SMALL_JPEG = image_bytes((300, 300), "JPEG")
+# A few KB on the wire, 25 megapixels decoded
+HUGE_PNG = image_bytes((5000, 5000), "PNG", mode="1")
+
+
+class ImageHostHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, content_type="image/jpeg", length=None):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body) if length is None else length))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/cover.jpg":
+            self._send(SMALL_JPEG)
+        elif self.path == "/redirect.jpg":
+            self.send_response(302)
+            self.send_header("Location", "/cover.jpg")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif self.path == "/page.html":
+            self._send(b"<html></html>", content_type="text/html")
+        elif self.path == "/huge-length.jpg":
+            self._send(b"", length=50 * 1024 * 1024)
+        elif self.path == "/no-length.jpg":
+            # Streams past the byte cap without announcing a length
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            try:
+                for _ in range(64):
+                    self.wfile.write(b"\0" * 64 * 1024)
+            except OSError:
+                pass
+            self.close_connection = True
+        elif self.path == "/trickle.jpg":
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(SMALL_JPEG)))
+            self.end_headers()
+            try:
+                for byte in SMALL_JPEG:
+                    self.wfile.write(bytes([byte]))
+                    self.wfile.flush()
+                    time.sleep(0.1)
+            except OSError:
+                pass
+        else:
+            self.send_error(404)
+
+
+@pytest.fixture(scope="module")
+def image_host():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ImageHostHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setattr(cover_cache, "COVER_FETCH_TIMEOUT", 1)
+    monkeypatch.setattr(cover_cache, "COVER_MAX_BYTES", 1024 * 1024)
+    # The test hosts listen on loopback
+    monkeypatch.setattr(cover_cache, "COVER_ALLOW_PRIVATE_HOSTS", True)
+
+
+def test_reads_a_cover(image_host, limits):
+    assert cover_cache.read_cover(f"{image_host}/cover.jpg") == SMALL_JPEG
+    assert cover_cache.fetch_cover_data_uri(f"{image_host}/cover.jpg").startswith("data:image/")
+
+
+def test_follows_redirects(image_host, limits):
+    assert cover_cache.read_cover(f"{image_host}/redirect.jpg") == SMALL_JPEG
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/cover.jpg",
+    "http://[::1]/cover.jpg",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://10.0.0.1/cover.jpg",
+    "http://[::ffff:192.168.1.1]/cover.jpg",
+    "file:///etc/passwd",
+    "ftp://example.com/cover.jpg"
+])
+def test_refuses_internal_and_non_http_urls(url):
+    with pytest.raises(ValueError):
+        cover_cache.read_cover(url)
+
+
+def test_unreachable_host_is_bounded_in_total(unreachable_host, limits):
+    started = time.monotonic()
+    with pytest.raises(Exception):
+        cover_cache.read_cover(f"{unreachable_host}/cover.jpg")
+    assert time.monotonic() - started < cover_cache.COVER_FETCH_TIMEOUT + 0.5
+
+
+def test_refuses_non_images(image_host, limits):
+    with pytest.raises(ValueError, match="not an image"):
+        cover_cache.read_cover(f"{image_host}/page.html")
+
+
+def test_refuses_announced_oversized_bodies(image_host, limits):
+    with pytest.raises(ValueError, match="too large"):
+        cover_cache.read_cover(f"{image_host}/huge-length.jpg")
+
+
+def test_stops_reading_past_the_byte_cap(image_host, limits):
+    with pytest.raises(ValueError, match="too large"):
+        cover_cache.read_cover(f"{image_host}/no-length.jpg")
+
+
+def test_total_time_is_bounded(image_host, limits):
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        cover_cache.read_cover(f"{image_host}/trickle.jpg")
+    assert time.monotonic() - started < cover_cache.COVER_FETCH_TIMEOUT + 0.5
+
+
+@pytest.mark.filterwarnings("ignore::PIL.Image.DecompressionBombWarning")
+def test_refuses_decompression_bombs():
+    with pytest.raises(ValueError, match="too large"):
+        cover_cache.process_cover(HUGE_PNG)
+
+
+def test_large_jpegs_still_shrink():
+    out = cover_cache.process_cover(image_bytes((2000, 1500), "JPEG"))
+    with Image.open(BytesIO(out)) as img:
+        assert img.size == (cover_cache.COVER_PIXELS, cover_cache.COVER_PIXELS)
@@ -0,0 +1,55 @@
+"""Request deadlines bound storage reads on the priority chain, not just upstream calls"""
+import time
+
+from deadline import Deadline
+from storage import MemoryStorage
+
+from conftest import TEST_USERS
+
+STORAGE_DELAY = 0.5
+
+
+class SlowStorage(MemoryStorage):
+    """MemoryStorage whose reads take STORAGE_DELAY, like a congested Firebase"""
+
+    def get_user(self, user_id):
+        time.sleep(STORAGE_DELAY)
+        return super().get_user(user_id)
+
+
+def use_slow_storage(monkeypatch, app_index):
+    slow = SlowStorage(TEST_USERS)
+    monkeypatch.setattr(app_index, 'storage', slow)
+    return slow
+
+
+def test_slow_credentials_read_is_cut_at_the_deadline(app_index, monkeypatch):
+    use_slow_storage(monkeypatch, app_index)
+
+    started = time.monotonic()
+    assert app_index.prepare_kugou_call('alice', Deadline(0.1)) is None
+    assert time.monotonic() - started < STORAGE_DELAY
+
+
+def test_slow_storage_still_answers_within_the_deadline(app_index, monkeypatch):
+    use_slow_storage(monkeypatch, app_index)
+    # Seen earlier by this instance
+    app_index.last_song_cache.set('alice', {'name': 'Remembered', 'artist': 'A', 'cover': ''})
+
+    started = time.monotonic()
+    song, tier = app_index.resolve_song('alice', deadline=Deadline(0.2))
+    assert time.monotonic() - started < STORAGE_DELAY
+    assert (song['name'], tier) == ('Remembered', 'storage')
+
+
+def test_abandoned_credentials_read_still_fills_the_cache(app_index, monkeypatch):
+    use_slow_storage(monkeypatch, app_index)
+    app_index.prepare_kugou_call('alice', Deadline(0.1))
+
+    time.sleep(STORAGE_DELAY + 0.2)
+    assert app_index.kugou_creds_cache.get('alice')['userid'] == '123456'
+
+
+def test_background_work_is_not_bounded(app_index, monkeypatch):
+    use_slow_storage(monkeypatch, app_index)
+    assert app_index.read_cached_song('alice')['name'] == 'Stored Song'
@@ -0,0 +1,37 @@
+"""Push rendering: widgets stored beside a song are only served for that song"""
+SONG_X = {'name': 'Song X', 'artist': 'Artist', 'cover': '', 'hash': 'HX'}
+SONG_Y = {'name': 'Song Y', 'artist': 'Artist', 'cover': '', 'hash': 'HY'}
+
+
+def stored_widget(app_index):
+    """pushed_widget for alice's stored song, as a fresh instance would see it"""
+    app_index.pushed_widgets.clear()
+    song = app_index.storage.get_current_song('alice')
+    theme, width, height = app_index.PUSH_RENDER_VARIANTS[0]
+    return app_index.pushed_widget('alice', song, theme, width, height, True)
+
+
+def record_song_x(app_index, monkeypatch):
+    """record_current_song(SONG_X) with its background push left to the test"""
+    monkeypatch.setattr(app_index, 'PUSH_RENDER', False)
+    app_index.record_current_song('alice', SONG_X)
+    return app_index.last_song_cache.get('alice')
+
+
+def test_stored_render_serves_its_song(app_index, monkeypatch):
+    record = record_song_x(app_index, monkeypatch)
+    app_index.push_render_stored('alice', record)
+
+    etag, svg = stored_widget(app_index)
+    assert b'Song X' in svg.body
+
+
+def test_late_push_is_not_served_for_a_newer_song(app_index, monkeypatch):
+    record = record_song_x(app_index, monkeypatch)
+
+    # Another instance (or the sync daemon) writes the next song
+    app_index.storage.set_current_song('alice', dict(SONG_Y, updated_at=2))
+    app_index.push_render_stored('alice', record)
+
+    assert 'rendered' in app_index.storage.get_current_song('alice')
+    assert stored_widget(app_index) is None
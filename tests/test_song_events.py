@@ -0,0 +1,25 @@
+"""/events: a reconnecting client isn't sent the song it already has"""
+SONG = {'name': 'Song X', 'artist': 'Artist', 'cover': '', 'hash': 'HX'}
+
+
+def test_event_id_ignores_the_tier(app_index):
+    realtime = app_index.song_event('alice', SONG, 'realtime')[1]
+    stored = app_index.song_event('alice', dict(SONG, updated_at=2), 'storage')[1]
+    assert realtime['id'] == stored['id']
+
+
+def test_reconnect_with_last_event_id_skips_an_unchanged_song(app_index, monkeypatch):
+    monkeypatch.setattr(app_index, 'start_song_watcher', lambda: None)
+    monkeypatch.setattr(app_index, 'SSE_MAX_SECONDS', 0)
+
+    # Seen live, published by a real-time fetch
+    published = []
+    unsubscribe = app_index.song_events.subscribe('alice', published.append)
+    app_index.record_current_song('alice', SONG)
+    unsubscribe()
+    assert published[0]['data']['tier'] == 'realtime'
+
+    # The reconnect is seeded from storage once the last subscriber has gone
+    app_index.last_song_cache.clear()
+    frames = list(app_index.song_event_stream('alice', published[0]['id']))
+    assert frames == [app_index.SSE_RETRY_FRAME]
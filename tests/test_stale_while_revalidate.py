@@ -0,0 +1,65 @@
+"""Stale-while-revalidate: background refreshes and the SONG_STALE_SECONDS limit"""
+import time
+
+import requests
+
+from test_upstream import FakeResponse, FakeSession, use_session
+
+STALE_SONG = {'name': 'Old Song', 'artist': 'Artist', 'cover': '', 'updated_at': 1}
+
+
+def seed_entry(app_index, age):
+    checked_at = time.time() - age
+    app_index.recent_song_cache.set('alice', (STALE_SONG, checked_at))
+    return checked_at
+
+
+def test_failed_refresh_keeps_checked_at(app_index, monkeypatch):
+    use_session(monkeypatch, app_index, FakeSession(requests.ConnectionError('down')))
+    checked_at = seed_entry(app_index, 100)
+
+    app_index.refresh_song('alice')
+    assert app_index.recent_song_cache.get('alice')[1] == checked_at
+
+
+def test_skipped_refresh_keeps_checked_at(app_index, monkeypatch):
+    session = use_session(monkeypatch, app_index, FakeSession(requests.ConnectionError('down')))
+    breaker = app_index.upstream_breaker
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure(app_index.get_kugou_credentials('alice')['api_url'])
+    checked_at = seed_entry(app_index, 100)
+
+    app_index.refresh_song('alice')
+    assert session.timeouts == []
+    assert app_index.recent_song_cache.get('alice')[1] == checked_at
+
+
+def test_empty_answer_confirms_the_song(app_index, monkeypatch):
+    use_session(monkeypatch, app_index, FakeSession(FakeResponse({'status': 1, 'data': []})))
+    checked_at = seed_entry(app_index, 100)
+
+    app_index.refresh_song('alice')
+    song, rechecked_at = app_index.recent_song_cache.get('alice')
+    assert song == STALE_SONG
+    assert rechecked_at > checked_at
+
+
+def test_stale_limit_holds_while_the_upstream_is_down(app_index, monkeypatch):
+    """Views keep arriving and every refresh fails: the song still expires SONG_STALE_SECONDS after its last check"""
+    session = use_session(monkeypatch, app_index, FakeSession(requests.ConnectionError('down')))
+    monkeypatch.setattr(app_index, 'SONG_FRESH_SECONDS', 10)
+    monkeypatch.setattr(app_index, 'SONG_STALE_SECONDS', 60)
+    # Refresh in the view itself instead of on refresh_executor
+    monkeypatch.setattr(app_index, 'schedule_song_refresh', app_index.refresh_song)
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now)
+    seed_entry(app_index, 0)
+
+    for _ in range(3):
+        now += 20
+        assert app_index.get_song_stale_while_revalidate('alice') == STALE_SONG
+    # Failed calls until the circuit opens, skipped ones after
+    assert len(session.timeouts) == app_index.upstream_breaker.failure_threshold
+
+    now += 20
+    assert app_index.get_song_stale_while_revalidate('alice') is None
@@ -0,0 +1,64 @@
+"""Storage backends: batch reads return the same nodes everywhere and only fetch what was asked for"""
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from storage import FirebaseStorage, MemoryStorage, SQLiteStorage
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from fake_firebase import FakeDatabase, seed_users  # noqa: E402
+
+USERS = seed_users(5, 'http://kugou-api.invalid')['users']
+
+
+class RecordingDatabase(FakeDatabase):
+    """FakeDatabase that remembers which paths were referenced"""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.paths = []
+
+    def reference(self, path=None):
+        self.paths.append(path)
+        return super().reference(path)
+
+
+def sqlite_storage(tmp_path):
+    backend = SQLiteStorage(str(tmp_path / 'widget.db'))
+    for user_id, user in USERS.items():
+        backend.set_credentials(user_id, user['kugou_credentials'])
+        backend.set_current_song(user_id, user['current_song'])
+    return backend
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'firebase'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryStorage(USERS)
+    if request.param == 'sqlite':
+        return sqlite_storage(tmp_path)
+    return FirebaseStorage(RecordingDatabase({'users': USERS}))
+
+
+@pytest.mark.parametrize('executor', [None, ThreadPoolExecutor(max_workers=4)])
+def test_get_users_matches_get_user(backend, executor):
+    user_ids = ['user-3', 'missing', 'user-0']
+    users = backend.get_users(user_ids, executor)
+
+    assert list(users) == user_ids
+    assert users['missing'] == {}
+    for user_id in ('user-0', 'user-3'):
+        assert users[user_id] == backend.get_user(user_id)
+        assert users[user_id]['kugou_credentials']['userid'] == USERS[user_id]['kugou_credentials']['userid']
+
+
+def test_firebase_batch_reads_only_the_requested_users():
+    database = RecordingDatabase({'users': USERS})
+    backend = FirebaseStorage(database)
+
+    users = backend.get_users(['user-0', 'user-4'], ThreadPoolExecutor(max_workers=2))
+
+    assert sorted(database.paths) == ['users/user-0', 'users/user-4']
+    assert set(users) == {'user-0', 'user-4'}
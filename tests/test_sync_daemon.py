@@ -0,0 +1,40 @@
+"""Sync daemon: loading the configured users"""
+import os
+import sys
+
+from storage import MemoryStorage
+
+from conftest import TEST_USERS
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sync_kugou_listening  # noqa: E402
+
+
+class CountingStorage(MemoryStorage):
+    """MemoryStorage that counts per-user reads by kind"""
+
+    def __init__(self, users):
+        super().__init__(users)
+        self.credential_reads = 0
+        self.bulk_reads = 0
+
+    def get_credentials(self, user_id):
+        self.credential_reads += 1
+        return super().get_credentials(user_id)
+
+    def get_users(self, user_ids, executor=None):
+        self.bulk_reads += 1
+        return super().get_users(user_ids, executor)
+
+
+def test_configured_users_reads_nodes_in_bulk_and_primes_credentials(app_index, monkeypatch):
+    users = dict(TEST_USERS, bob={'kugou_credentials': {'api_url': 'http://kugou-api.invalid'}}, carol={})
+    storage = CountingStorage(users)
+    monkeypatch.setattr(app_index, 'storage', storage)
+
+    assert sync_kugou_listening.configured_users(app_index) == ['alice']
+    assert (storage.bulk_reads, storage.credential_reads) == (1, 0)
+
+    # The polls that follow find alice's credentials cached
+    assert app_index.get_kugou_credentials('alice')['userid'] == '123456'
+    assert storage.credential_reads == 0
@@ -0,0 +1,119 @@
+"""The KuGouMusicApi call path: deadline-bounded calls and the circuit breaker"""
+import time
+
+import requests
+
+from circuit_breaker import CLOSED, OPEN
+from deadline import Deadline
+
+from conftest import TEST_API_URL
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self.payload = payload
+        self.status_code = status_code
+
+    def json(self):
+        return self.payload
+
+
+class FakeSession:
+    """Answers every get() with the next scripted response, or raises it if it is an exception"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.timeouts = []
+
+    def get(self, url, params=None, timeout=None):
+        self.timeouts.append(timeout)
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def use_session(monkeypatch, app_index, session):
+    monkeypatch.setattr(app_index, 'get_session', lambda retries=True: session)
+    return session
+
+
+def test_hanging_upstream_opens_the_circuit(app_index, monkeypatch):
+    """Request-path calls time out on the deadline, well short of KUGOU_API_TIMEOUT, and still count"""
+    session = use_session(monkeypatch, app_index, FakeSession(requests.ReadTimeout('read timed out')))
+    breaker = app_index.upstream_breaker
+
+    for _ in range(breaker.failure_threshold):
+        assert app_index.get_song_from_kugou_api('alice', Deadline()) is None
+
+    assert max(session.timeouts) < app_index.KUGOU_API_TIMEOUT
+    assert breaker.state(TEST_API_URL) == OPEN
+
+    # Further views fail fast instead of waiting out the deadline again
+    calls = len(session.timeouts)
+    assert app_index.get_song_from_kugou_api('alice', Deadline()) is None
+    assert len(session.timeouts) == calls
+
+
+def test_connect_timeout_leaves_time_for_the_stored_song(app_index, unreachable_host):
+    """A request's call is never retried: the stored song still fits the deadline"""
+    app_index.storage.set_credentials('alice', {'api_url': unreachable_host, 'userid': '123456', 'token': 'secret-token'})
+
+    started = time.monotonic()
+    song, tier = app_index.resolve_song('alice', deadline=Deadline(2))
+    assert time.monotonic() - started < 2
+    assert (song['name'], tier) == ('Stored Song', 'storage')
+
+
+def test_wrapped_read_timeouts_count(app_index, monkeypatch):
+    """The retry adapter surfaces read timeouts as ConnectionError(MaxRetryError(ReadTimeoutError))"""
+    from urllib3.exceptions import MaxRetryError, ReadTimeoutError
+
+    wrapped = requests.ConnectionError(MaxRetryError(None, '/user/recentListening', ReadTimeoutError(None, '', '')))
+    use_session(monkeypatch, app_index, FakeSession(wrapped))
+    breaker = app_index.upstream_breaker
+
+    for _ in range(breaker.failure_threshold):
+        app_index.get_song_from_kugou_api('alice', Deadline())
+    assert breaker.state(TEST_API_URL) == OPEN
+
+
+def test_timeout_on_a_spent_deadline_does_not_count(app_index, monkeypatch):
+    session = use_session(monkeypatch, app_index, FakeSession(requests.ReadTimeout('read timed out')))
+    breaker = app_index.upstream_breaker
+
+    for _ in range(breaker.failure_threshold + 1):
+        app_index.get_song_from_kugou_api('alice', Deadline(0.8))
+
+    assert max(session.timeouts) < app_index.CIRCUIT_TIMEOUT_SECONDS
+    assert breaker.state(TEST_API_URL) == CLOSED
+
+
+def test_server_errors_count_and_success_closes(app_index, monkeypatch):
+    song = {'status': 1, 'data': [{'songname': 'Song', 'singername': 'Artist', 'img': '', 'hash': 'H1'}]}
+    session = FakeSession(FakeResponse({}, status_code=502), FakeResponse(song))
+    use_session(monkeypatch, app_index, session)
+    breaker = app_index.upstream_breaker
+
+    assert app_index.get_song_from_kugou_api('alice', Deadline()) is None
+    assert breaker.stats()['failing'] == 1
+
+    result = app_index.get_song_from_kugou_api('alice', Deadline())
+    assert result['name'] == 'Song'
+    assert breaker.stats()['failing'] == 0
+    assert app_index.storage.get_current_song('alice')['hash'] == 'H1'
+
+
+def test_trace_never_carries_the_error_message(app_index, monkeypatch):
+    from metrics import end_trace, start_trace
+
+    error = requests.ConnectionError("Max retries exceeded with url: /user/recentListening?token=secret-token")
+    use_session(monkeypatch, app_index, FakeSession(error))
+    trace = start_trace()
+    try:
+        app_index.get_song_from_kugou_api('alice', Deadline())
+    finally:
+        end_trace()
+
+    assert 'secret-token' not in repr(trace.as_dict())
+    assert trace.steps[0] == {'step': 'kugou_api', 'outcome': 'error', 'error': 'ConnectionError'}